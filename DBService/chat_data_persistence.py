@@ -0,0 +1,169 @@
+import asyncio
+import copy
+import json
+import time
+import zlib
+from telegram.ext import BasePersistence, PersistenceInput
+
+import constants
+from chat_state import ChatState
+from DBService.sqlite_database import SQLiteDatabase
+from OpenAIService.chat_session import ChatSession
+
+class ChatDataPersistence(BasePersistence, SQLiteDatabase):
+    # Stores chat_data of every chat as compressed JSON in SQLite. Nothing is loaded on startup:
+    # the data of a chat is read only when an update of this chat arrives (see refresh_chat_data),
+    # and changed chats are written in one transaction per persistence update interval.
+    _SELECT_CHAT_DATA_QUERY = "SELECT data FROM chat_data WHERE chat_id = ?"
+    _STORE_CHAT_DATA_QUERY = "INSERT OR REPLACE INTO chat_data (chat_id, data) VALUES (?, ?)"
+    _DELETE_CHAT_DATA_QUERY = "DELETE FROM chat_data WHERE chat_id = ?"
+
+    def __init__(self, db_name: str = constants.CHAT_DATA_DB_NAME, update_interval: float = constants.PERSISTENCE_UPDATE_INTERVAL_SECONDS):
+        super().__init__(PersistenceInput(bot_data=False, chat_data=True, user_data=False, callback_data=False), update_interval)
+        SQLiteDatabase.__init__(self, db_name, "chat_data_db", [
+            """
+            CREATE TABLE IF NOT EXISTS chat_data (
+                chat_id INTEGER PRIMARY KEY,
+                data BLOB
+            )
+            """
+        ])
+        # chat_id -> chat_data dict of the application, for chats which are loaded into memory
+        self._loaded_chat_data: dict[int, dict] = {}
+        # chat_id -> time of the last update of a loaded chat
+        self._last_updates: dict[int, float] = {}
+        # Chats removed from the application by eviction, its drop_chat_data call must not delete their stored data
+        self._evicted_chat_ids = set()
+        # chat_id -> chat_data waiting to be written, None means that chat data has to be deleted
+        self._pending_chat_data = {}
+        self._write_task = None
+
+    async def get_chat_data(self) -> dict:
+        return {}
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict):
+        # Called by the application before every update of the chat is handled
+        self._last_updates[chat_id] = time.monotonic()
+        if chat_id in self._loaded_chat_data:
+            return
+        if chat_id in self._pending_chat_data:
+            stored_chat_data = self._pending_chat_data[chat_id] or {}
+        else:
+            stored_chat_data = await self._run(self._load_chat_data, chat_id)
+        chat_data.update(stored_chat_data)
+        self._loaded_chat_data[chat_id] = chat_data
+
+    async def update_chat_data(self, chat_id: int, data: dict):
+        # Data of a chat which is not loaded is not complete and must not overwrite the stored one
+        if chat_id in self._loaded_chat_data:
+            self._pending_chat_data[chat_id] = data
+            self._schedule_write()
+
+    def idle_chat_ids(self, idle_time: float) -> list[int]:
+        idle_since = time.monotonic() - idle_time
+        return [chat_id for chat_id, last_update in self._last_updates.items() if last_update < idle_since]
+
+    def evict_chat_data(self, chat_id: int):
+        # Moves chat data from memory to the database, it is loaded back on the next update of the chat.
+        # The caller removes the chat from the application with Application.drop_chat_data afterwards.
+        chat_data = self._loaded_chat_data.pop(chat_id, None)
+        self._last_updates.pop(chat_id, None)
+        if chat_data is None:
+            return
+        self._pending_chat_data[chat_id] = chat_data
+        self._evicted_chat_ids.add(chat_id)
+        self._schedule_write()
+
+    async def drop_chat_data(self, chat_id: int):
+        if chat_id in self._evicted_chat_ids:
+            self._evicted_chat_ids.discard(chat_id)
+            # The application skips the update of a chat which is dropped, so if the chat was loaded again
+            # before this call, its current data is written instead
+            if chat_id in self._loaded_chat_data:
+                self._pending_chat_data[chat_id] = copy.deepcopy(self._loaded_chat_data[chat_id])
+                self._schedule_write()
+            return
+        self._pending_chat_data[chat_id] = None
+        self._loaded_chat_data.pop(chat_id, None)
+        self._last_updates.pop(chat_id, None)
+        self._schedule_write()
+
+    async def flush(self):
+        if self._write_task:
+            await self._write_task
+        await self._write_pending_chat_data()
+        self.close()
+
+    def _schedule_write(self):
+        if self._write_task is None or self._write_task.done():
+            self._write_task = asyncio.create_task(self._write_pending_chat_data())
+
+    async def _write_pending_chat_data(self):
+        # Let the rest of the current persistence update add its chats to the same transaction
+        await asyncio.sleep(0)
+        pending_chat_data, self._pending_chat_data = self._pending_chat_data, {}
+        if pending_chat_data:
+            await self._run(self._store_chat_data, pending_chat_data)
+
+    def _load_chat_data(self, chat_id: int) -> dict:
+        row = self._connection.execute(self._SELECT_CHAT_DATA_QUERY, (chat_id,)).fetchone()
+        return self._deserialize(row[0]) if row else {}
+
+    def _store_chat_data(self, pending_chat_data: dict):
+        with self._connection:
+            for chat_id, chat_data in pending_chat_data.items():
+                if chat_data is None:
+                    self._connection.execute(self._DELETE_CHAT_DATA_QUERY, (chat_id,))
+                else:
+                    self._connection.execute(self._STORE_CHAT_DATA_QUERY, (chat_id, self._serialize(chat_data)))
+
+    @staticmethod
+    def _serialize(chat_data: dict) -> bytes:
+        data = dict(chat_data)
+        if constants.CHAT_STATE_FIELD in data:
+            data[constants.CHAT_STATE_FIELD] = data[constants.CHAT_STATE_FIELD].name
+        if constants.CHAT_CLIENT in data:
+            data[constants.CHAT_CLIENT] = data[constants.CHAT_CLIENT].to_dict()
+        return zlib.compress(json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode())
+
+    @staticmethod
+    def _deserialize(serialized_chat_data: bytes) -> dict:
+        data = json.loads(zlib.decompress(serialized_chat_data))
+        if constants.CHAT_STATE_FIELD in data:
+            data[constants.CHAT_STATE_FIELD] = ChatState[data[constants.CHAT_STATE_FIELD]]
+        if constants.CHAT_CLIENT in data:
+            data[constants.CHAT_CLIENT] = ChatSession.from_dict(data[constants.CHAT_CLIENT])
+        return data
+
+    async def get_user_data(self) -> dict:
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name: str) -> dict:
+        return {}
+
+    async def update_conversation(self, name: str, key: tuple, new_state: object):
+        pass
+
+    async def update_user_data(self, user_id: int, data: dict):
+        pass
+
+    async def update_bot_data(self, data: dict):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_user_data(self, user_id: int):
+        pass
+
+    async def refresh_user_data(self, user_id: int, user_data: dict):
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict):
+        pass
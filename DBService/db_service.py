@@ -1,36 +1,47 @@
-import sqlite3
 from cryptography.fernet import Fernet
 
-class ApiKeysDatabaseService:
-    def __init__(self, encryption_key: str, db_name: str = "api_keys.db"):
-        self._db_name = db_name
-        self._init_database()
-        self._fernet = Fernet(encryption_key)
+import constants
+from DBService.sqlite_database import SQLiteDatabase
+from ttl_cache import TTLCache
 
-    def _init_database(self):
-        connection = sqlite3.connect(self._db_name)
-        cursor = connection.cursor()
+class ApiKeysDatabaseService(SQLiteDatabase):
+    _SELECT_API_KEY_QUERY = "SELECT api_key FROM users WHERE user_id = ?"
+    _STORE_API_KEY_QUERY = "INSERT OR REPLACE INTO users (user_id, api_key) VALUES (?, ?)"
 
-        cursor.execute(
+    def __init__(self, encryption_key: str, db_name: str = "api_keys.db", cache_ttl: float = constants.API_KEYS_CACHE_TTL_SECONDS):
+        super().__init__(db_name, "api_keys_db", [
             """
             CREATE TABLE IF NOT EXISTS users (
                 user_id INTEGER PRIMARY KEY,
                 api_key TEXT
             )
             """
-        )
-
-        connection.commit()
-        connection.close()
-
-    def get_api_key(self, user_id: int) -> str:
-        connection = sqlite3.connect(self._db_name)
-        cursor = connection.cursor()
-
-        cursor.execute(f"SELECT api_key FROM users WHERE user_id={user_id}")
-        encrypted_api_key = cursor.fetchone()
-
-        connection.close()
+        ])
+        self._fernet = Fernet(encryption_key)
+        self._api_keys_cache = TTLCache(constants.API_KEYS_CACHE_SIZE, cache_ttl)
+        self._stores_count = 0
+
+    @property
+    def stats(self) -> dict:
+        return {"cache_hits": self._api_keys_cache.hits, "cache_misses": self._api_keys_cache.misses}
+
+    async def get_api_key(self, user_id: int) -> str | None:
+        api_key = self._api_keys_cache.get(user_id)
+        if api_key is None:
+            stores_count = self._stores_count
+            api_key = await self._run(self._select_api_key, user_id)
+            # A key stored while the query was waiting could make it return the old key, which must not be cached
+            if api_key and stores_count == self._stores_count:
+                self._api_keys_cache.set(user_id, api_key)
+        return api_key
+
+    async def store_api_key(self, user_id: int, api_key: str):
+        self._stores_count += 1
+        self._api_keys_cache.pop(user_id)
+        await self._run(self._store_api_key, user_id, api_key)
+
+    def _select_api_key(self, user_id: int) -> str | None:
+        encrypted_api_key = self._connection.execute(self._SELECT_API_KEY_QUERY, (user_id,)).fetchone()
 
         if encrypted_api_key:
             decrypted_api_key = self._fernet.decrypt(encrypted_api_key[0].encode()).decode()
@@ -38,16 +49,8 @@ class ApiKeysDatabaseService:
         else:
             return None
 
-    def store_api_key(self, user_id, api_key: str):
+    def _store_api_key(self, user_id: int, api_key: str):
         encrypted_api_key = self._fernet.encrypt(api_key.encode()).decode()
 
-        connection = sqlite3.connect(self._db_name)
-        cursor = connection.cursor()
-
-        cursor.execute(
-            "INSERT OR REPLACE INTO users (user_id, api_key) VALUES (?, ?)",
-            (user_id, encrypted_api_key)
-        )
-
-        connection.commit()
-        connection.close()
+        with self._connection:
+            self._connection.execute(self._STORE_API_KEY_QUERY, (user_id, encrypted_api_key))
@@ -0,0 +1,21 @@
+import json
+
+import constants
+from DBService.sqlite_database import SQLiteLRUCache
+
+class ImageCacheService(SQLiteLRUCache):
+    # Telegram file_ids of generated images keyed by normalized description and size, so the same images can be
+    # resent without generating them again. The least recently used entries are removed above max_entries.
+    def __init__(self, db_name: str = constants.IMAGE_CACHE_DB_NAME, max_entries: int = constants.IMAGE_CACHE_MAX_ENTRIES):
+        super().__init__(db_name, "image_cache_db", "images", ("description", "size"), "file_ids", max_entries)
+
+    async def get_images(self, description: str, size: str) -> list[str]:
+        file_ids = await self._get((self._normalize(description), size))
+        return json.loads(file_ids) if file_ids else []
+
+    async def store_images(self, description: str, size: str, file_ids: list[str]):
+        await self._set((self._normalize(description), size), json.dumps(file_ids))
+
+    @staticmethod
+    def _normalize(description: str) -> str:
+        return " ".join(description.casefold().split())
@@ -0,0 +1,90 @@
+import asyncio
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+class SQLiteDatabase:
+    # The connection is opened once in WAL mode and used only from the single database thread,
+    # so queries never block the event loop and never run concurrently.
+    def __init__(self, db_name: str, thread_name_prefix: str, schema: list[str]):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=thread_name_prefix)
+        self._connection = sqlite3.connect(db_name, check_same_thread=False)
+        self._init_database(schema)
+
+    def _init_database(self, schema: list[str]):
+        cursor = self._connection.cursor()
+
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        for statement in schema:
+            cursor.execute(statement)
+
+        self._connection.commit()
+
+    def close(self):
+        self._executor.shutdown()
+        self._connection.close()
+
+    async def _run(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+
+class SQLiteLRUCache(SQLiteDatabase):
+    # Values stored in a table keyed by key_columns. The least recently used entries are removed above max_entries.
+    def __init__(
+        self,
+        db_name: str,
+        thread_name_prefix: str,
+        table: str,
+        key_columns: tuple[str, ...],
+        value_column: str,
+        max_entries: int
+    ):
+        key_condition = " AND ".join(f"{column} = ?" for column in key_columns)
+        columns = ", ".join(key_columns + (value_column, "last_access"))
+        self._select_query = f"SELECT {value_column} FROM {table} WHERE {key_condition}"
+        self._touch_query = f"UPDATE {table} SET last_access = ? WHERE {key_condition}"
+        self._store_query = f"INSERT OR REPLACE INTO {table} ({columns}) VALUES ({', '.join('?' * (len(key_columns) + 2))})"
+        self._count_query = f"SELECT COUNT(*) FROM {table}"
+        self._evict_query = f"DELETE FROM {table} WHERE rowid IN (SELECT rowid FROM {table} ORDER BY last_access LIMIT ?)"
+        self._max_entries = max_entries
+        self._hits = 0
+        self._misses = 0
+        super().__init__(db_name, thread_name_prefix, [
+            f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                {", ".join(f"{column} TEXT" for column in key_columns)},
+                {value_column} TEXT,
+                last_access REAL,
+                PRIMARY KEY ({", ".join(key_columns)})
+            )
+            """,
+            f"CREATE INDEX IF NOT EXISTS {table}_last_access ON {table} (last_access)"
+        ])
+
+    @property
+    def stats(self) -> dict:
+        return {"hits": self._hits, "misses": self._misses}
+
+    async def _get(self, key: tuple) -> str | None:
+        return await self._run(self._select, key)
+
+    async def _set(self, key: tuple, value: str):
+        await self._run(self._store, key, value)
+
+    def _select(self, key: tuple) -> str | None:
+        value = self._connection.execute(self._select_query, key).fetchone()
+        if not value:
+            self._misses += 1
+            return None
+        self._hits += 1
+
+        with self._connection:
+            self._connection.execute(self._touch_query, (time.time(),) + key)
+        return value[0]
+
+    def _store(self, key: tuple, value: str):
+        with self._connection:
+            self._connection.execute(self._store_query, key + (value, time.time()))
+            entries_count = self._connection.execute(self._count_query).fetchone()[0]
+            if entries_count > self._max_entries:
+                self._connection.execute(self._evict_query, (entries_count - self._max_entries,))
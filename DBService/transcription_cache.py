@@ -0,0 +1,14 @@
+import constants
+from DBService.sqlite_database import SQLiteLRUCache
+
+class TranscriptionCacheService(SQLiteLRUCache):
+    # Transcriptions of media files keyed by Telegram file_unique_id, which is the same for forwarded
+    # and re-sent copies of a file. The least recently used entries are removed above max_entries.
+    def __init__(self, db_name: str = constants.TRANSCRIPTION_CACHE_DB_NAME, max_entries: int = constants.TRANSCRIPTION_CACHE_MAX_ENTRIES):
+        super().__init__(db_name, "transcription_cache_db", "transcriptions", ("file_unique_id",), "transcription", max_entries)
+
+    async def get_transcription(self, file_unique_id: str) -> str | None:
+        return await self._get((file_unique_id,))
+
+    async def store_transcription(self, file_unique_id: str, transcription: str):
+        await self._set((file_unique_id,), transcription)
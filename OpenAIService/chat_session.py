@@ -0,0 +1,69 @@
+import time
+import constants
+
+class ChatSession:
+    def __init__(self, role: str):
+        self._system_message = {"role": "system", "content": constants.ASSISTANT_ROLE_PROMPT.format(role=role)}
+        self._summary = None
+        self._history = []
+        self.last_activity = time.time()
+
+    @property
+    def messages(self) -> list:
+        messages = [self._system_message]
+        if self._summary:
+            messages.append({"role": "system", "content": constants.CHAT_SUMMARY_MESSAGE_PREFIX + self._summary})
+        return messages + self._history
+
+    @property
+    def summary(self) -> str | None:
+        return self._summary
+
+    @summary.setter
+    def summary(self, summary: str):
+        self._summary = summary
+
+    def add_exchange(self, question: str, answer: str):
+        self._history.append({"role": "user", "content": question})
+        self._history.append({"role": "assistant", "content": answer})
+        self.last_activity = time.time()
+
+    def trim_history(self, max_tokens: int) -> list:
+        # Drops the oldest question-answer pairs until the conversation fits into max_tokens
+        dropped_messages = self.history_overflow(max_tokens)
+        self.drop_history(len(dropped_messages))
+        return dropped_messages
+
+    def history_overflow(self, max_tokens: int) -> list:
+        # The oldest question-answer pairs which don't fit into max_tokens, the history itself is not changed
+        tokens_count = self.count_tokens(self.messages)
+        overflow_length = 0
+        while overflow_length < len(self._history) and tokens_count > max_tokens:
+            tokens_count -= self.count_tokens(self._history[overflow_length:overflow_length + 2])
+            overflow_length += 2
+        return self._history[:overflow_length]
+
+    def drop_history(self, messages_count: int):
+        del self._history[:messages_count]
+
+    @staticmethod
+    def count_tokens(messages: list) -> int:
+        # Rough estimation which is good enough for the budget and does not need a tokenizer
+        return sum(len(message["content"]) // constants.CHARS_PER_TOKEN + constants.MESSAGE_TOKENS_OVERHEAD for message in messages)
+
+    def to_dict(self) -> dict:
+        return {
+            "system_message": self._system_message,
+            "summary": self._summary,
+            "history": self._history,
+            "last_activity": self.last_activity
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "ChatSession":
+        chat_session = cls.__new__(cls)
+        chat_session._system_message = data["system_message"]
+        chat_session._summary = data["summary"]
+        chat_session._history = data["history"]
+        chat_session.last_activity = data["last_activity"]
+        return chat_session
@@ -0,0 +1,56 @@
+import asyncio
+from typing import Awaitable, Callable
+
+import constants
+from ttl_cache import TTLCache
+
+class CompletionCache:
+    # Answers of stateless completion requests keyed by model and normalized prompt. Identical requests
+    # which arrive while the first one is still in progress wait for its answer instead of calling the API.
+    # Only answers are shared: errors depend on the API key of the caller (invalid key, its rate limits),
+    # so if the first request fails or is cancelled, the waiters make their own requests.
+    def __init__(
+        self,
+        max_size: int = constants.COMPLETION_CACHE_MAX_ENTRIES,
+        max_memory_size: int = constants.COMPLETION_CACHE_MAX_MEMORY_SIZE,
+        ttl: float = constants.COMPLETION_CACHE_TTL_SECONDS
+    ):
+        self._answers = TTLCache(max_size, ttl, weigher=len, max_weight=max_memory_size)
+        self._in_flight_requests: dict[tuple, asyncio.Future] = {}
+        self._coalesced_count = 0
+
+    @property
+    def stats(self) -> dict:
+        return {
+            "hits": self._answers.hits,
+            "misses": self._answers.misses,
+            "coalesced": self._coalesced_count,
+            "entries": len(self._answers),
+            "memory_size": self._answers.weight
+        }
+
+    async def get_or_request(self, model: str, prompt: str, request: Callable[[], Awaitable[str]]) -> str:
+        key = (model, " ".join(prompt.casefold().split()))
+        answer = self._answers.get(key)
+        if answer is not None:
+            return answer
+
+        in_flight_request = self._in_flight_requests.get(key)
+        if in_flight_request:
+            self._coalesced_count += 1
+            answer = await asyncio.shield(in_flight_request)
+            # None means that the request of another caller failed or was cancelled, so it is repeated
+            return answer if answer is not None else await self.get_or_request(model, prompt, request)
+
+        in_flight_request = asyncio.get_running_loop().create_future()
+        self._in_flight_requests[key] = in_flight_request
+        try:
+            answer = await request()
+            self._answers.set(key, answer)
+            in_flight_request.set_result(answer)
+            return answer
+        except BaseException:
+            in_flight_request.set_result(None)
+            raise
+        finally:
+            del self._in_flight_requests[key]
@@ -0,0 +1,64 @@
+import importlib.util
+import logging
+logger = logging.getLogger(__name__)
+
+import httpx
+
+import constants
+
+class OpenAIConnectionPool:
+    # Keep-alive connections to OpenAI API shared by all users of the process, so requests don't pay
+    # for a TLS handshake each time. API keys are passed with every request, not bound to connections.
+    def __init__(
+        self,
+        max_connections: int = constants.DEFAULT_OPENAI_MAX_CONNECTIONS,
+        keepalive_expiry: float = constants.DEFAULT_OPENAI_KEEPALIVE_EXPIRY_SECONDS,
+        connect_timeout: float = constants.DEFAULT_OPENAI_CONNECT_TIMEOUT_SECONDS,
+        timeout: float = constants.OPENAI_REQUEST_TIMEOUT_SECONDS,
+        http2: bool = True,
+        base_url: str = constants.OPENAI_API_BASE_URL
+    ):
+        # HTTP/2 multiplexes concurrent requests over a few connections but requires the optional h2 package
+        if http2 and importlib.util.find_spec("h2") is None:
+            logger.warning("h2 package was not found, connections to OpenAI API will use HTTP/1.1")
+            http2 = False
+        self._max_connections = max_connections
+        self._transport = httpx.AsyncHTTPTransport(
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+                keepalive_expiry=keepalive_expiry
+            )
+        )
+        self._client = httpx.AsyncClient(
+            base_url=base_url,
+            transport=self._transport,
+            timeout=httpx.Timeout(timeout, connect=connect_timeout)
+        )
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        return self._client
+
+    @property
+    def max_connections(self) -> int:
+        return self._max_connections
+
+    @property
+    def stats(self) -> dict:
+        stats = {"max_connections": self._max_connections}
+        # httpx doesn't expose its connection pool, so the numbers are skipped if its internals change
+        try:
+            connections = self._transport._pool.connections
+            stats |= {
+                "connections": len(connections),
+                "idle_connections": sum(connection.is_idle() for connection in connections),
+                "http2_connections": sum("HTTP/2" in connection.info() for connection in connections)
+            }
+        except AttributeError:
+            pass
+        return stats
+
+    async def close(self):
+        await self._client.aclose()
@@ -0,0 +1,130 @@
+import asyncio
+import io
+import logging
+import shutil
+import string
+import tempfile
+logger = logging.getLogger(__name__)
+
+from typing import Awaitable, BinaryIO, Callable
+
+import constants
+from OpenAIService.openai_service import OpenAIService
+
+class MediaTranscriber:
+    # Long media are split into overlapping segments with ffmpeg which are transcribed concurrently,
+    # so latency no longer grows with duration and large files stay below the API size limit.
+    # Without ffmpeg every file is transcribed with a single request.
+    def __init__(
+        self,
+        openai_service: OpenAIService,
+        segment_duration: int = constants.TRANSCRIPTION_SEGMENT_DURATION_SECONDS,
+        segment_overlap: int = constants.TRANSCRIPTION_SEGMENT_OVERLAP_SECONDS,
+        max_concurrent_segments: int = constants.DEFAULT_MAX_CONCURRENT_TRANSCRIPTION_SEGMENTS
+    ):
+        self._openai_service = openai_service
+        self._segment_duration = segment_duration
+        self._segment_overlap = segment_overlap
+        self._max_concurrent_segments = max_concurrent_segments
+        self._ffmpeg_path = shutil.which("ffmpeg")
+        if not self._ffmpeg_path:
+            logger.warning("ffmpeg was not found, long media files will be transcribed without splitting")
+
+    async def transcript(
+        self,
+        api_key: str,
+        media_file: BinaryIO,
+        extension: str,
+        duration: int | None,
+        on_progress: Callable[[str], Awaitable] | None = None
+    ) -> str:
+        if not self._ffmpeg_path or not duration or duration <= self._segment_duration:
+            return await self._openai_service.transcript_media(api_key, media_file, f"media.{extension}")
+
+        step = self._segment_duration - self._segment_overlap
+        segment_starts = list(range(0, duration, step))
+        transcriptions = [None] * len(segment_starts)
+        # The cap is applied per file: a shared one would make short files wait behind all segments of a long one,
+        # while the total load on the API is already limited by the request scheduler
+        segments_semaphore = asyncio.Semaphore(self._max_concurrent_segments)
+        with tempfile.NamedTemporaryFile(suffix=f".{extension}") as source_file:
+            # ffmpeg needs a seekable file in order to cut segments from the middle of the media: a pipe would
+            # make every segment decode the media from the beginning and fails for MP4 files with the index at the end
+            await asyncio.to_thread(shutil.copyfileobj, media_file, source_file)
+            await asyncio.to_thread(source_file.flush)
+
+            transcribed_count = 0
+            tasks = [
+                asyncio.create_task(self._transcript_segment(api_key, source_file.name, index, start, segments_semaphore))
+                for index, start in enumerate(segment_starts)
+            ]
+            try:
+                for task in asyncio.as_completed(tasks):
+                    index, transcription = await task
+                    transcriptions[index] = transcription
+                    # Only the beginning of the media without gaps can be shown to the user
+                    ready_count = transcribed_count
+                    while ready_count < len(transcriptions) and transcriptions[ready_count] is not None:
+                        ready_count += 1
+                    if ready_count > transcribed_count:
+                        transcribed_count = ready_count
+                        if on_progress and transcribed_count < len(transcriptions):
+                            await on_progress(self._stitch(transcriptions[:transcribed_count]))
+            finally:
+                for task in tasks:
+                    task.cancel()
+                # The temporary file must outlive the ffmpeg processes which still read it
+                await asyncio.gather(*tasks, return_exceptions=True)
+        return self._stitch(transcriptions)
+
+    async def _transcript_segment(
+        self,
+        api_key: str,
+        source_filename: str,
+        index: int,
+        start: int,
+        segments_semaphore: asyncio.Semaphore
+    ) -> tuple[int, str]:
+        async with segments_semaphore:
+            segment = await self._cut_segment(source_filename, start)
+            with io.BytesIO(segment) as segment_file:
+                return index, await self._openai_service.transcript_media(api_key, segment_file, "segment.mp3")
+
+    async def _cut_segment(self, source_filename: str, start: int) -> bytes:
+        process = await asyncio.create_subprocess_exec(
+            self._ffmpeg_path, "-v", "error",
+            "-ss", str(start), "-t", str(self._segment_duration), "-i", source_filename,
+            "-vn", "-ac", "1", "-ar", "16000", "-b:a", "64k", "-f", "mp3", "pipe:1",
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        try:
+            segment, error = await process.communicate()
+        finally:
+            # communicate() leaves the process running when it is cancelled
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+        if process.returncode != 0:
+            raise RuntimeError(f"ffmpeg failed to cut segment at {start}s: {error.decode(errors='ignore')}")
+        return segment
+
+    @classmethod
+    def _stitch(cls, transcriptions: list) -> str:
+        words = []
+        for transcription in transcriptions:
+            segment_words = transcription.split()
+            words += segment_words[cls._overlap_length(words, segment_words):]
+        return " ".join(words)
+
+    @staticmethod
+    def _overlap_length(words: list, next_words: list) -> int:
+        # Segments overlap by a few seconds, so the end of one text usually repeats at the beginning of the next one
+        def normalize(word: str) -> str:
+            return word.strip(string.punctuation).lower()
+
+        max_length = min(len(words), len(next_words), constants.TRANSCRIPTION_MAX_OVERLAP_WORDS)
+        for length in range(max_length, 0, -1):
+            if [normalize(word) for word in words[-length:]] == [normalize(word) for word in next_words[:length]]:
+                return length
+        return 0
@@ -0,0 +1,200 @@
+import asyncio
+import json
+import logging
+logger = logging.getLogger(__name__)
+
+import httpx
+
+from typing import AsyncIterator, BinaryIO
+
+import constants
+from OpenAIService.chat_session import ChatSession
+from OpenAIService.completion_cache import CompletionCache
+from OpenAIService.connection_pool import OpenAIConnectionPool
+from OpenAIService.request_scheduler import RequestExpiredError, RequestScheduler
+from metrics import Histogram
+
+_request_latency = Histogram("openai_request_duration_seconds", "Duration of OpenAI API requests", ("endpoint",))
+
+class OpenAIService:
+    def __init__(
+        self,
+        connection_pool: OpenAIConnectionPool,
+        max_chat_history_tokens: int = constants.DEFAULT_CHAT_HISTORY_MAX_TOKENS,
+        summarize_chat_history: bool = False,
+        completion_cache: CompletionCache | None = None
+    ):
+        self._completion_cache = completion_cache
+        self._max_chat_history_tokens = max_chat_history_tokens
+        self._summarize_chat_history = summarize_chat_history
+        self._connection_pool = connection_pool
+        self._client = connection_pool.client
+        self._scheduler = RequestScheduler(connection_pool.max_connections)
+
+    async def close(self):
+        await self._connection_pool.close()
+
+    @property
+    def stats(self) -> dict:
+        return self._connection_pool.stats | self._scheduler.stats
+
+    @property
+    def completion_cache(self) -> CompletionCache | None:
+        return self._completion_cache
+
+    async def ask_question(self, api_key: str, question: str) -> str:
+        if self._completion_cache:
+            return await self._completion_cache.get_or_request(
+                constants.TEXT_COMPLETION_MODEL,
+                question,
+                lambda: self._request_completion(api_key, question)
+            )
+        return await self._request_completion(api_key, question)
+
+    async def ask_chat(self, api_key: str, chat_session: ChatSession, message: str) -> str:
+        await self._fit_chat_history(api_key, chat_session, message)
+        response = await self._post(api_key, "/chat/completions", json={
+            "model": constants.CHAT_COMPLETION_MODEL,
+            "messages": chat_session.messages + [{"role": "user", "content": message}]
+        })
+        answer = response["choices"][0]["message"]["content"].strip()
+        chat_session.add_exchange(message, answer)
+        return answer
+
+    async def stream_chat(self, api_key: str, chat_session: ChatSession, message: str) -> AsyncIterator[str]:
+        await self._fit_chat_history(api_key, chat_session, message)
+        answer = ""
+        request = {
+            "model": constants.CHAT_COMPLETION_MODEL,
+            "messages": chat_session.messages + [{"role": "user", "content": message}],
+            "stream": True
+        }
+        attempt = 0
+        while True:
+            async with self._scheduler.slot(api_key, "/chat/completions"):
+                # Streamed answers are measured until the response starts, the rest depends on the answer length
+                with _request_latency.time("/chat/completions:stream"):
+                    response = await self._client.send(
+                        self._client.build_request("POST", "/chat/completions", headers=self._headers(api_key), json=request),
+                        stream=True
+                    )
+                try:
+                    retry_delay = self._scheduler.retry_delay(api_key, "/chat/completions", attempt, response)
+                    if retry_delay is None:
+                        response.raise_for_status()
+                        async for line in response.aiter_lines():
+                            if not line.startswith("data: "):
+                                continue
+                            data = line[len("data: "):]
+                            if data == "[DONE]":
+                                break
+                            chunk = json.loads(data)["choices"][0]["delta"].get("content")
+                            if chunk:
+                                answer += chunk
+                                yield chunk
+                        break
+                finally:
+                    await response.aclose()
+            await asyncio.sleep(retry_delay)
+            attempt += 1
+        chat_session.add_exchange(message, answer.strip())
+
+    async def transcript_media(self, api_key: str, media_file: BinaryIO, filename: str) -> str:
+        response = await self._post(
+            api_key,
+            "/audio/transcriptions",
+            data={"model": constants.TRANSCRIPTION_MODEL},
+            files={"file": (filename, media_file)}
+        )
+        return response["text"]
+
+    async def generate_images(self, api_key: str, description: str, count: int, size: str) -> AsyncIterator[str]:
+        # Every image is requested separately, so the urls are yielded in the order the images are ready.
+        # Failed images are skipped, the error is raised only if no image was generated. A request which expired
+        # in the queue means that the rate limit of the key is exhausted, so the rest of them are not waited for.
+        requests = [asyncio.create_task(self._generate_image(api_key, description, size)) for _ in range(count)]
+        generated_count, last_error = 0, None
+        try:
+            for request in asyncio.as_completed(requests):
+                try:
+                    image_url = await request
+                except httpx.HTTPError as error:
+                    logger.warning(f"Image generation failed: {error}")
+                    last_error = error
+                    continue
+                generated_count += 1
+                yield image_url
+        finally:
+            # Images which are not needed anymore are not waited for, errors of finished ones are retrieved to not be reported
+            for request in requests:
+                if not request.cancel() and not request.cancelled():
+                    request.exception()
+        if generated_count == 0 and last_error:
+            raise last_error
+
+    async def _generate_image(self, api_key: str, description: str, size: str) -> str:
+        response = await self._post(api_key, "/images/generations", json={
+            "prompt": description,
+            "n": 1,
+            "size": size
+        })
+        return response["data"][0]["url"]
+
+    async def _request_completion(self, api_key: str, question: str) -> str:
+        response = await self._post(api_key, "/completions", json={
+            "model": constants.TEXT_COMPLETION_MODEL,
+            "prompt": question,
+            "max_tokens": constants.TEXT_COMPLETION_MAX_TOKENS
+        })
+        return response["choices"][0]["text"].strip()
+
+    async def _fit_chat_history(self, api_key: str, chat_session: ChatSession, message: str):
+        max_tokens = self._max_chat_history_tokens - ChatSession.count_tokens([{"role": "user", "content": message}])
+        if self._summarize_chat_history:
+            # Messages are dropped only after they are summarized, so a failed summarization doesn't lose them
+            overflow = chat_session.history_overflow(max_tokens - constants.CHAT_SUMMARY_MAX_TOKENS)
+            if not overflow:
+                return
+            try:
+                chat_session.summary = await self._summarize(api_key, chat_session.summary, overflow)
+            except (httpx.HTTPError, RequestExpiredError) as error:
+                # The question is still answered, the history is trimmed without a summary as if it was disabled
+                logger.warning(f"Chat history was not summarized: {error}")
+            else:
+                chat_session.drop_history(len(overflow))
+                return
+        chat_session.trim_history(max_tokens)
+
+    async def _summarize(self, api_key: str, summary: str | None, messages: list) -> str:
+        conversation = "\n".join(f"{message['role']}: {message['content']}" for message in messages)
+        if summary:
+            conversation = f"{summary}\n{conversation}"
+        response = await self._post(api_key, "/chat/completions", json={
+            "model": constants.CHAT_COMPLETION_MODEL,
+            "messages": [
+                {"role": "system", "content": constants.CHAT_SUMMARIZATION_PROMPT},
+                {"role": "user", "content": conversation}
+            ],
+            "max_tokens": constants.CHAT_SUMMARY_MAX_TOKENS
+        })
+        return response["choices"][0]["message"]["content"].strip()
+
+    async def _post(self, api_key: str, endpoint: str, **kwargs) -> dict:
+        attempt = 0
+        while True:
+            # Uploaded files are read by every attempt, so they have to be sent from the beginning again
+            for _, file in kwargs.get("files", {}).values():
+                file.seek(0)
+            async with self._scheduler.slot(api_key, endpoint):
+                with _request_latency.time(endpoint):
+                    response = await self._client.post(endpoint, headers=self._headers(api_key), **kwargs)
+            retry_delay = self._scheduler.retry_delay(api_key, endpoint, attempt, response)
+            if retry_delay is None:
+                response.raise_for_status()
+                return response.json()
+            await asyncio.sleep(retry_delay)
+            attempt += 1
+
+    @staticmethod
+    def _headers(api_key: str) -> dict:
+        return {"Authorization": f"Bearer {api_key}"}
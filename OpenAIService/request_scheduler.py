@@ -0,0 +1,164 @@
+import asyncio
+import random
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+
+import httpx
+
+import constants
+from ttl_cache import TTLCache
+
+class RequestExpiredError(Exception):
+    pass
+
+class TokenBucket:
+    def __init__(self, requests_per_minute: int):
+        self._capacity = requests_per_minute
+        self._rate = requests_per_minute / 60
+        self._tokens = float(requests_per_minute)
+        self._updated_at = time.monotonic()
+        self._paused_until = 0.0
+
+    def time_until_available(self, now: float) -> float:
+        self._refill(now)
+        return max(self._paused_until - now, (1 - self._tokens) / self._rate, 0.0)
+
+    def consume(self, now: float):
+        self._refill(now)
+        self._tokens -= 1
+
+    def pause(self, seconds: float):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def _refill(self, now: float):
+        self._tokens = min(self._capacity, self._tokens + (now - self._updated_at) * self._rate)
+        self._updated_at = now
+
+class _PendingRequest:
+    def __init__(self, future: asyncio.Future, max_queue_time: float):
+        self.future = future
+        self.max_queue_time = max_queue_time
+        self.expires_at = time.monotonic() + max_queue_time
+
+class RequestScheduler:
+    # Decides which OpenAI request is sent next. Every API key has a token bucket per endpoint, so one user
+    # can't exceed the OpenAI rate limits of their key with a burst, and requests which wait for a free slot
+    # are taken from different users in turn. Requests which waited longer than max_queue_time are dropped,
+    # endpoints with low rate limits can be given more time in endpoint_max_queue_times.
+    def __init__(
+        self,
+        max_concurrent_requests: int,
+        max_queue_time: float = constants.OPENAI_MAX_QUEUE_TIME_SECONDS,
+        rate_limits: dict = constants.OPENAI_RATE_LIMITS,
+        endpoint_max_queue_times: dict = constants.OPENAI_ENDPOINT_MAX_QUEUE_TIMES_SECONDS
+    ):
+        self._max_concurrent_requests = max_concurrent_requests
+        self._free_slots = max_concurrent_requests
+        self._max_queue_time = max_queue_time
+        self._endpoint_max_queue_times = endpoint_max_queue_times
+        self._rate_limits = rate_limits
+        # Full buckets of idle keys are equal to new ones, so they are forgotten after a minute without requests
+        self._buckets = TTLCache(constants.OPENAI_RATE_LIMIT_BUCKETS_COUNT, 60)
+        # (api_key, endpoint) -> queue of requests, the order of the keys is the order in which they are served
+        self._queues: OrderedDict[tuple, deque] = OrderedDict()
+        self._dispatch_timer = None
+
+    @property
+    def stats(self) -> dict:
+        return {
+            "requests_in_flight": self._max_concurrent_requests - self._free_slots,
+            "queued_requests": sum(len(queue) for queue in self._queues.values())
+        }
+
+    @asynccontextmanager
+    async def slot(self, api_key: str, endpoint: str):
+        await self._acquire(api_key, endpoint)
+        try:
+            yield
+        finally:
+            self._free_slots += 1
+            self._dispatch()
+
+    def retry_delay(self, api_key: str, endpoint: str, attempt: int, response: httpx.Response) -> float | None:
+        if response.status_code not in constants.OPENAI_RETRY_STATUS_CODES or attempt >= constants.OPENAI_MAX_RETRIES:
+            return None
+        try:
+            delay = float(response.headers["retry-after"]) + random.uniform(0, constants.OPENAI_RETRY_BASE_DELAY_SECONDS)
+        except (KeyError, ValueError):
+            delay = random.uniform(0, min(constants.OPENAI_RETRY_MAX_DELAY_SECONDS, constants.OPENAI_RETRY_BASE_DELAY_SECONDS * 2 ** attempt))
+        # The limit is shared by all requests of the key, so the rest of them have to wait as well
+        self._get_bucket(api_key, endpoint).pause(delay)
+        return delay
+
+    async def _acquire(self, api_key: str, endpoint: str):
+        max_queue_time = self._endpoint_max_queue_times.get(endpoint, self._max_queue_time)
+        request = _PendingRequest(asyncio.get_running_loop().create_future(), max_queue_time)
+        self._queues.setdefault((api_key, endpoint), deque()).append(request)
+        self._dispatch()
+        try:
+            await request.future
+        except asyncio.CancelledError:
+            # The slot could be granted right before the waiting task was cancelled
+            if request.future.done() and not request.future.cancelled():
+                self._free_slots += 1
+                self._dispatch()
+            raise
+
+    def _dispatch(self):
+        now = time.monotonic()
+        next_dispatch_delay = None
+        # Requests expire even while all slots are busy
+        for queue_key in list(self._queues):
+            self._drop_expired_requests(queue_key, now)
+        granted = True
+        while granted and self._free_slots > 0:
+            granted = False
+            for queue_key in list(self._queues):
+                if self._free_slots == 0:
+                    break
+                if not self._drop_expired_requests(queue_key, now):
+                    continue
+                queue = self._queues[queue_key]
+
+                bucket = self._get_bucket(*queue_key)
+                wait_time = bucket.time_until_available(now)
+                if wait_time > 0:
+                    next_dispatch_delay = min(next_dispatch_delay or wait_time, wait_time)
+                    continue
+
+                bucket.consume(now)
+                self._free_slots -= 1
+                queue.popleft().future.set_result(None)
+                granted = True
+                # The key goes to the end of the line, so other users are served before its next request
+                self._queues.move_to_end(queue_key)
+                if not queue:
+                    del self._queues[queue_key]
+
+        if self._queues:
+            oldest_request_expiry = min(queue[0].expires_at for queue in self._queues.values()) - now
+            next_dispatch_delay = min(next_dispatch_delay or oldest_request_expiry, oldest_request_expiry)
+        if self._dispatch_timer:
+            self._dispatch_timer.cancel()
+            self._dispatch_timer = None
+        if next_dispatch_delay is not None:
+            self._dispatch_timer = asyncio.get_running_loop().call_later(max(next_dispatch_delay, 0.01), self._dispatch)
+
+    def _drop_expired_requests(self, queue_key: tuple, now: float) -> bool:
+        # Removes expired and cancelled requests from the head of the queue, returns whether any requests are left
+        queue = self._queues[queue_key]
+        while queue and (queue[0].future.done() or now > queue[0].expires_at):
+            expired_request = queue.popleft()
+            if not expired_request.future.done():
+                expired_request.future.set_exception(RequestExpiredError(f"Request waited more than {expired_request.max_queue_time} seconds"))
+        if not queue:
+            del self._queues[queue_key]
+        return bool(queue)
+
+    def _get_bucket(self, api_key: str, endpoint: str) -> TokenBucket:
+        bucket = self._buckets.get((api_key, endpoint))
+        if bucket is None:
+            bucket = TokenBucket(self._rate_limits[endpoint])
+        self._buckets.set((api_key, endpoint), bucket)
+        return bucket
@@ -0,0 +1,89 @@
+import asyncio
+import json
+
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Awaitable, Callable
+
+@dataclass
+class FakeResponse:
+    status: int = 200
+    body: bytes = b""
+    content_type: str = "application/json"
+    # Streamed responses are sent with chunked transfer encoding as the chunks are produced
+    chunks: AsyncIterator[bytes] | None = None
+
+    @classmethod
+    def json(cls, data, status: int = 200) -> "FakeResponse":
+        return cls(status, json.dumps(data).encode())
+
+@dataclass
+class FakeRequest:
+    method: str
+    path: str
+    headers: dict = field(default_factory=dict)
+    body: bytes = b""
+
+class FakeHttpServer:
+    # Minimal keep-alive HTTP/1.1 server for the fake Telegram and OpenAI APIs
+    def __init__(self, host: str, port: int, handle_request: Callable[[FakeRequest], Awaitable[FakeResponse]]):
+        self._host = host
+        self._port = port
+        self._handle_request = handle_request
+        self._server = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self._host}:{self.port}"
+
+    @property
+    def port(self) -> int:
+        return self._server.sockets[0].getsockname()[1]
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_connection, self._host, self._port)
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while request_line := await reader.readline():
+                method, path, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                if headers.get("transfer-encoding", "").lower() == "chunked":
+                    body = await self._read_chunked_body(reader)
+                else:
+                    body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+                response = await self._handle_request(FakeRequest(method, path, headers, body))
+                await self._respond(writer, response)
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _read_chunked_body(reader: asyncio.StreamReader) -> bytes:
+        body = b""
+        while chunk_size := int((await reader.readline()).split(b";", 1)[0], 16):
+            body += await reader.readexactly(chunk_size)
+            await reader.readline()
+        await reader.readline()
+        return body
+
+    @staticmethod
+    async def _respond(writer: asyncio.StreamWriter, response: FakeResponse):
+        head = f"HTTP/1.1 {response.status} Fake\r\nContent-Type: {response.content_type}\r\n"
+        if response.chunks is None:
+            writer.write(f"{head}Content-Length: {len(response.body)}\r\n\r\n".encode() + response.body)
+        else:
+            writer.write(f"{head}Transfer-Encoding: chunked\r\n\r\n".encode())
+            async for chunk in response.chunks:
+                writer.write(f"{len(chunk):x}\r\n".encode() + chunk + b"\r\n")
+                await writer.drain()
+            writer.write(b"0\r\n\r\n")
+        await writer.drain()
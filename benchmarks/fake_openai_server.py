@@ -0,0 +1,67 @@
+import asyncio
+import json
+import random
+
+from collections import Counter
+
+from benchmarks.fake_http_server import FakeHttpServer, FakeRequest, FakeResponse
+
+FAKE_ANSWER_WORDS = ("Sure,", "here", "is", "a", "synthetic", "answer", "from", "the", "fake", "OpenAI", "server.")
+STREAM_CHUNKS_COUNT = 20
+
+class FakeOpenAIServer:
+    # Fake OpenAI API for completions, chat completions (also streamed), image generations and transcriptions.
+    # Requests take a random time around the configured latency, error_rate is the share of requests
+    # answered with 429 or 500 errors, which the bot retries.
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.5, error_rate: float = 0.0):
+        self._server = FakeHttpServer(host, port, self._handle_request)
+        self._latency = latency
+        self._error_rate = error_rate
+        self.requests = Counter()
+        self.errors_count = 0
+
+    @property
+    def url(self) -> str:
+        return f"{self._server.url}/v1"
+
+    async def start(self):
+        await self._server.start()
+
+    async def stop(self):
+        await self._server.stop()
+
+    async def _handle_request(self, request: FakeRequest) -> FakeResponse:
+        endpoint = request.path.removeprefix("/v1")
+        self.requests[endpoint] += 1
+        latency = random.uniform(0.5, 1.5) * self._latency
+        if random.random() < self._error_rate:
+            self.errors_count += 1
+            await asyncio.sleep(latency / 10)
+            status = random.choice((429, 500))
+            return FakeResponse.json({"error": {"message": "Fake error", "type": "server_error"}}, status)
+
+        if endpoint == "/chat/completions" and json.loads(request.body).get("stream"):
+            return FakeResponse(content_type="text/event-stream", chunks=self._stream_answer(latency))
+
+        await asyncio.sleep(latency)
+        answer = " ".join(FAKE_ANSWER_WORDS)
+        if endpoint == "/completions":
+            return FakeResponse.json({"choices": [{"text": answer}]})
+        if endpoint == "/chat/completions":
+            return FakeResponse.json({"choices": [{"message": {"role": "assistant", "content": answer}}]})
+        if endpoint == "/images/generations":
+            return FakeResponse.json({"data": [{"url": f"https://images.invalid/{random.getrandbits(64):x}.png"}]})
+        if endpoint == "/audio/transcriptions":
+            return FakeResponse.json({"text": answer})
+        return FakeResponse.json({"error": {"message": "Unknown endpoint"}}, 404)
+
+    @staticmethod
+    async def _stream_answer(latency: float):
+        # Half of the latency is spent before the first chunk, the rest is spread between chunks
+        await asyncio.sleep(latency / 2)
+        for index in range(STREAM_CHUNKS_COUNT):
+            word = FAKE_ANSWER_WORDS[index % len(FAKE_ANSWER_WORDS)]
+            chunk = {"choices": [{"delta": {"content": f"{word} "}}]}
+            yield f"data: {json.dumps(chunk)}\n\n".encode()
+            await asyncio.sleep(latency / 2 / STREAM_CHUNKS_COUNT)
+        yield b"data: [DONE]\n\n"
@@ -0,0 +1,89 @@
+import asyncio
+import itertools
+import json
+import random
+import time
+
+from collections import Counter
+from urllib.parse import parse_qsl
+
+from benchmarks.fake_http_server import FakeHttpServer, FakeRequest, FakeResponse
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Benchmark", "username": "benchmark_bot"}
+FAKE_MEDIA_FILE = b"\x00" * 16 * 1024
+
+class FakeTelegramServer:
+    # Fake Bot API which answers every method the bot uses after a random latency around the configured one.
+    # error_rate is the share of requests answered with a 500 error. Sent texts are kept per chat, so
+    # the load test can count error replies.
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.05, error_rate: float = 0.0):
+        self._server = FakeHttpServer(host, port, self._handle_request)
+        self._latency = latency
+        self._error_rate = error_rate
+        self._message_ids = itertools.count(1_000_000)
+        self._file_ids = itertools.count(1)
+        self.calls = Counter()
+        self.errors_count = 0
+        self.sent_texts: Counter = Counter()
+
+    @property
+    def url(self) -> str:
+        return self._server.url
+
+    async def start(self):
+        await self._server.start()
+
+    async def stop(self):
+        await self._server.stop()
+
+    async def _handle_request(self, request: FakeRequest) -> FakeResponse:
+        await asyncio.sleep(random.uniform(0.5, 1.5) * self._latency)
+        # Paths are /bot<token>/<method> and /file/bot<token>/<file_path>
+        if request.path.startswith("/file/"):
+            return FakeResponse(body=FAKE_MEDIA_FILE, content_type="application/octet-stream")
+        method = request.path.rsplit("/", 1)[-1]
+        self.calls[method] += 1
+        if random.random() < self._error_rate:
+            self.errors_count += 1
+            return FakeResponse.json({"ok": False, "error_code": 500, "description": "Internal Server Error"}, 500)
+
+        parameters = self._parse_parameters(request)
+        result = self._answer(method, parameters)
+        return FakeResponse.json({"ok": True, "result": result})
+
+    @staticmethod
+    def _parse_parameters(request: FakeRequest) -> dict:
+        if request.headers.get("content-type", "").startswith("application/json"):
+            return json.loads(request.body or b"{}")
+        return dict(parse_qsl(request.body.decode()))
+
+    def _answer(self, method: str, parameters: dict):
+        chat_id = int(parameters.get("chat_id", 0))
+        if method == "getMe":
+            return BOT_USER
+        if method in ("sendMessage", "editMessageText"):
+            if method == "sendMessage":
+                self.sent_texts[parameters.get("text", "")] += 1
+            return self._message(chat_id, text=parameters.get("text", ""))
+        if method == "sendPhoto":
+            return self._message(chat_id, photo=[self._photo_size()])
+        if method == "sendMediaGroup":
+            media = json.loads(parameters.get("media", "[]"))
+            return [self._message(chat_id, photo=[self._photo_size()]) for _ in media]
+        if method == "getFile":
+            file_id = parameters.get("file_id", "")
+            return {"file_id": file_id, "file_unique_id": file_id, "file_size": len(FAKE_MEDIA_FILE), "file_path": f"media/{file_id}"}
+        return True
+
+    def _message(self, chat_id: int, **content) -> dict:
+        return {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": BOT_USER,
+            **content
+        }
+
+    def _photo_size(self) -> dict:
+        file_id = next(self._file_ids)
+        return {"file_id": f"photo{file_id}", "file_unique_id": f"photo{file_id}", "width": 256, "height": 256}
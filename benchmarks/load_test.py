@@ -0,0 +1,343 @@
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+
+from collections import Counter, defaultdict
+
+from cryptography.fernet import Fernet
+from telegram import Update
+
+import constants
+from bot import ChatGPTBot
+from log_config import configure_logging
+from benchmarks.fake_openai_server import FakeOpenAIServer
+from benchmarks.fake_telegram_server import FakeTelegramServer
+
+# Runs the real bot handlers against fake Telegram and OpenAI servers with synthetic multi-user traffic:
+#   python -m benchmarks.load_test --users 100 --openai-latency 0.5 --json report.json
+# Every user sets an API key and then goes through random flows, waiting until each update is processed,
+# like a real user waits for the answer before sending the next message.
+
+BENCHMARK_BOT_TOKEN = "123456:BENCHMARK"
+LOOP_LAG_CHECK_INTERVAL_SECONDS = 0.05
+ERROR_REPLIES = (constants.TRY_AGAIN_MESSAGE, constants.OPENAI_IS_BUSY_MESSAGE, constants.OPERATION_TIMED_OUT_MESSAGE)
+CHAT_MESSAGES_PER_FLOW = 3
+VOICE_DURATION_SECONDS = 5
+MEDIA_DURATION_SECONDS = 30
+
+def _text(text: str) -> dict:
+    return {"text": text}
+
+def _command(command: str) -> dict:
+    return {"text": command, "entities": [{"type": "bot_command", "offset": 0, "length": len(command)}]}
+
+def _media(kind: str, file_id: str, duration: int) -> dict:
+    return {kind: {"file_id": file_id, "file_unique_id": file_id, "duration": duration, "file_size": 16 * 1024}}
+
+def _button(buttons: list) -> str:
+    return buttons[0][0].text
+
+class SyntheticUser:
+    # Builds the steps (step label, message content) of one user's session
+    def __init__(self, user_id: int, rng: random.Random):
+        self._user_id = user_id
+        self._rng = rng
+        self._counter = itertools.count()
+
+    def setup_steps(self) -> list[tuple[str, dict]]:
+        return [
+            ("start", _command("/start")),
+            ("set_api_key", _text(_button(constants.SET_API_KEY_BUTTON))),
+            ("api_key", _text(f"sk-benchmark-{self._user_id}"))
+        ]
+
+    def flow_steps(self, flow: str) -> list[tuple[str, dict]]:
+        return getattr(self, f"_{flow}_flow")()
+
+    def _chat_flow(self) -> list[tuple[str, dict]]:
+        role = self._rng.choice(constants.ASSISTANT_ROLES_BUTTONS)[0].text
+        return [
+            ("start_chat", _text(_button(constants.START_CHAT_BUTTON))),
+            ("assistant_role", _text(role)),
+            *[("chat_message", _text(self._unique_text("Tell me something about"))) for _ in range(CHAT_MESSAGES_PER_FLOW)],
+            ("end_chat", _text(_button(constants.END_CHAT_BUTTON)))
+        ]
+
+    def _question_flow(self) -> list[tuple[str, dict]]:
+        return [("question", _text(self._unique_text("What is")))]
+
+    def _image_flow(self) -> list[tuple[str, dict]]:
+        count_button = self._rng.choice(constants.IMAGE_COUNT_BUTTONS[0])
+        return [
+            ("generate_image", _text(_button(constants.GENERATE_IMAGE_BUTTON))),
+            ("image_description", _text(self._unique_text("A painting of"))),
+            ("image_count", _text(count_button.text)),
+            ("image_size", _text(self._rng.choice(list(constants.IMAGE_SIZES))))
+        ]
+
+    def _voice_flow(self) -> list[tuple[str, dict]]:
+        return [("voice_question", _media("voice", self._unique_text("voice"), VOICE_DURATION_SECONDS))]
+
+    def _media_flow(self) -> list[tuple[str, dict]]:
+        return [
+            ("transcript_media", _text(_button(constants.TRANSCRIPT_MEDIA_BUTTON))),
+            ("media_file", _media("audio", self._unique_text("audio"), MEDIA_DURATION_SECONDS))
+        ]
+
+    def _unique_text(self, prefix: str) -> str:
+        # Unique texts and files keep the completion, image and transcription caches out of the measurement
+        return f"{prefix} {self._user_id}-{next(self._counter)}"
+
+class FakeServersThread:
+    # The fake servers run on their own event loop, so their work doesn't show up as lag of the bot event loop
+    def __init__(self, *servers):
+        self._servers = servers
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="fake_servers", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        for server in self._servers:
+            asyncio.run_coroutine_threadsafe(server.start(), self._loop).result()
+
+    def stop(self):
+        for server in self._servers:
+            asyncio.run_coroutine_threadsafe(server.stop(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+class LoadTest:
+    def __init__(self, args: argparse.Namespace):
+        self._args = args
+        self._flows, self._flow_weights = zip(*args.mix.items())
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._pending_updates: dict[int, tuple[str, asyncio.Future]] = {}
+        self._latencies: dict[str, list[float]] = defaultdict(list)
+        self._bot_api_calls: dict[str, list[int]] = defaultdict(list)
+        self._completed_flows = Counter()
+        self._timed_out_updates_count = 0
+        self._loop_lags: list[float] = []
+        self._peak_rss = 0
+        self._application = None
+
+    async def run(self) -> dict:
+        telegram_server = FakeTelegramServer(latency=self._args.telegram_latency, error_rate=self._args.telegram_error_rate)
+        openai_server = FakeOpenAIServer(latency=self._args.openai_latency, error_rate=self._args.openai_error_rate)
+        servers = FakeServersThread(telegram_server, openai_server)
+        servers.start()
+        os.environ[constants.TELEGRAM_API_SERVER_ENV] = telegram_server.url
+        os.environ[constants.OPENAI_API_BASE_URL_ENV] = openai_server.url
+        os.environ[constants.OPENAI_HTTP2_ENV] = "0"
+        os.environ[constants.API_KEYS_DB_ENCRYPTION_KEY_ENV] = Fernet.generate_key().decode()
+
+        bot = ChatGPTBot(BENCHMARK_BOT_TOKEN)
+        bot.bot_api_calls_counter.on_interaction_finished = self._record_bot_api_calls
+        self._application = bot.application
+        self._measure_update_processing()
+        async with self._application:
+            await self._application.post_init(self._application)
+            await self._application.start()
+            baseline_rss = self._peak_rss = _rss_bytes()
+            monitor = asyncio.create_task(self._monitor_event_loop())
+
+            start_time = time.perf_counter()
+            await asyncio.gather(*(self._run_user(index) for index in range(self._args.users)))
+            duration = time.perf_counter() - start_time
+
+            monitor.cancel()
+            await self._application.stop()
+            await self._application.post_stop(self._application)
+        await self._application.post_shutdown(self._application)
+        servers.stop()
+
+        return self._report(duration, baseline_rss, telegram_server, openai_server)
+
+    def _measure_update_processing(self):
+        # The processor gets every update after the bot took it from the queue and finishes with it after all handlers
+        processor = self._application.update_processor
+        process_update = processor.do_process_update
+
+        async def measured_process_update(update: object, coroutine):
+            start_time = time.perf_counter()
+            try:
+                await process_update(update, coroutine)
+            finally:
+                label, processed = self._pending_updates.pop(update.update_id)
+                self._latencies[label].append(time.perf_counter() - start_time)
+                processed.set_result(None)
+        processor.do_process_update = measured_process_update
+
+    def _record_bot_api_calls(self, update_id: int | None, calls: Counter):
+        # Called before the update is removed from pending ones by measured_process_update
+        if update_id in self._pending_updates:
+            self._bot_api_calls[self._pending_updates[update_id][0]].append(calls.total())
+
+    async def _monitor_event_loop(self):
+        while True:
+            start_time = time.perf_counter()
+            await asyncio.sleep(LOOP_LAG_CHECK_INTERVAL_SECONDS)
+            self._loop_lags.append(time.perf_counter() - start_time - LOOP_LAG_CHECK_INTERVAL_SECONDS)
+            self._peak_rss = max(self._peak_rss, _rss_bytes())
+
+    async def _run_user(self, index: int):
+        rng = random.Random(self._args.seed * 1_000_003 + index)
+        user_id = 10_000 + index
+        user = SyntheticUser(user_id, rng)
+        await asyncio.sleep(rng.uniform(0, self._args.ramp_up))
+
+        for label, content in user.setup_steps():
+            await self._send(user_id, label, content, rng)
+        for flow in rng.choices(self._flows, self._flow_weights, k=self._args.flows_per_user):
+            for label, content in user.flow_steps(flow):
+                await self._send(user_id, label, content, rng)
+            self._completed_flows[flow] += 1
+
+    async def _send(self, user_id: int, label: str, content: dict, rng: random.Random):
+        update_id = next(self._update_ids)
+        user = {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"}
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": user,
+            **content
+        }
+        processed = asyncio.get_running_loop().create_future()
+        self._pending_updates[update_id] = (label, processed)
+        await self._application.update_queue.put(Update.de_json({"update_id": update_id, "message": message}, self._application.bot))
+        try:
+            await asyncio.wait_for(asyncio.shield(processed), self._args.step_timeout)
+        except asyncio.TimeoutError:
+            self._timed_out_updates_count += 1
+        if self._args.think_time:
+            await asyncio.sleep(rng.uniform(0, 2 * self._args.think_time))
+
+    def _report(self, duration: float, baseline_rss: int, telegram_server: FakeTelegramServer, openai_server: FakeOpenAIServer) -> dict:
+        all_latencies = [latency for latencies in self._latencies.values() for latency in latencies]
+        updates_count = len(all_latencies)
+        return {
+            "config": vars(self._args),
+            "duration_seconds": round(duration, 3),
+            "updates": updates_count,
+            "throughput_updates_per_second": round(updates_count / duration, 2),
+            "completed_flows": dict(self._completed_flows),
+            "timed_out_updates": self._timed_out_updates_count,
+            "error_replies": sum(telegram_server.sent_texts[text] for text in ERROR_REPLIES),
+            "handler_latency_ms": {
+                "all": _latency_summary(all_latencies),
+                **{label: _latency_summary(latencies) for label, latencies in sorted(self._latencies.items())}
+            },
+            "event_loop_lag_ms": {
+                "mean": round(1000 * sum(self._loop_lags) / max(len(self._loop_lags), 1), 2),
+                "p99": round(1000 * _percentile(self._loop_lags, 99), 2),
+                "max": round(1000 * max(self._loop_lags, default=0), 2)
+            },
+            "memory": {
+                "baseline_rss_mb": round(baseline_rss / 2**20, 1),
+                "peak_rss_mb": round(self._peak_rss / 2**20, 1),
+                "per_session_kb": round((self._peak_rss - baseline_rss) / 1024 / self._args.users, 1)
+            },
+            "telegram_api": {
+                "calls_per_update": round(sum(telegram_server.calls.values()) / max(updates_count, 1), 2),
+                "calls": dict(telegram_server.calls),
+                "calls_per_update_by_step": {
+                    label: {"mean": round(sum(counts) / len(counts), 2), "max": max(counts)}
+                    for label, counts in sorted(self._bot_api_calls.items())
+                },
+                "injected_errors": telegram_server.errors_count
+            },
+            "openai_api": {
+                "requests": dict(openai_server.requests),
+                "injected_errors": openai_server.errors_count
+            }
+        }
+
+def _percentile(values: list[float], percent: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, round(percent / 100 * len(values)) - 1))]
+
+def _latency_summary(latencies: list[float]) -> dict:
+    return {
+        "count": len(latencies),
+        **{f"p{percent}": round(1000 * _percentile(latencies, percent), 1) for percent in (50, 95, 99)},
+        "max": round(1000 * max(latencies, default=0), 1)
+    }
+
+def _rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        import resource
+        # Peak instead of current RSS where /proc is not available, in kilobytes on Linux but bytes on macOS
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def _print_report(report: dict):
+    print(f"Users: {report['config']['users']}, updates: {report['updates']}, duration: {report['duration_seconds']} s, "
+          f"throughput: {report['throughput_updates_per_second']} updates/s")
+    print(f"Completed flows: {report['completed_flows']}, timed out updates: {report['timed_out_updates']}, error replies: {report['error_replies']}")
+    print("Handler latency, ms:")
+    for label, summary in report["handler_latency_ms"].items():
+        print(f"  {label:<18} count {summary['count']:>6}  p50 {summary['p50']:>8}  p95 {summary['p95']:>8}  p99 {summary['p99']:>8}  max {summary['max']:>8}")
+    lag = report["event_loop_lag_ms"]
+    print(f"Event loop lag, ms: mean {lag['mean']}, p99 {lag['p99']}, max {lag['max']}")
+    memory = report["memory"]
+    print(f"Memory: baseline RSS {memory['baseline_rss_mb']} MB, peak RSS {memory['peak_rss_mb']} MB, {memory['per_session_kb']} KB per session")
+    telegram_api = report["telegram_api"]
+    print(f"Telegram API: {telegram_api['calls_per_update']} calls per update, {telegram_api['calls']}, injected errors {telegram_api['injected_errors']}")
+    print("Telegram API calls per update:")
+    for label, summary in telegram_api["calls_per_update_by_step"].items():
+        print(f"  {label:<18} mean {summary['mean']:>6}  max {summary['max']:>4}")
+    openai_api = report["openai_api"]
+    print(f"OpenAI API: {openai_api['requests']}, injected errors {openai_api['injected_errors']}")
+
+def _parse_mix(mix: str) -> dict[str, float]:
+    flows = {}
+    for item in mix.split(","):
+        flow, _, weight = item.partition("=")
+        if flow not in ("chat", "question", "image", "voice", "media"):
+            raise argparse.ArgumentTypeError(f"Unknown flow '{flow}'")
+        flows[flow] = float(weight or 1)
+    return flows
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test of the bot against fake Telegram and OpenAI servers")
+    parser.add_argument("--users", type=int, default=50, help="number of simultaneous users")
+    parser.add_argument("--flows-per-user", type=int, default=5, help="number of flows every user goes through")
+    parser.add_argument("--mix", type=_parse_mix, default="chat=4,question=2,image=1,voice=2,media=1", help="weights of chat, question, image, voice and media flows")
+    parser.add_argument("--think-time", type=float, default=0.0, help="mean pause of a user between messages in seconds")
+    parser.add_argument("--ramp-up", type=float, default=1.0, help="users start during this number of seconds")
+    parser.add_argument("--telegram-latency", type=float, default=0.05, help="mean latency of the fake Bot API in seconds")
+    parser.add_argument("--telegram-error-rate", type=float, default=0.0, help="share of Bot API requests which fail")
+    parser.add_argument("--openai-latency", type=float, default=0.5, help="mean latency of the fake OpenAI API in seconds")
+    parser.add_argument("--openai-error-rate", type=float, default=0.0, help="share of OpenAI requests answered with 429 or 500")
+    parser.add_argument("--step-timeout", type=float, default=300.0, help="seconds to wait for one update to be processed")
+    parser.add_argument("--seed", type=int, default=1, help="seed of the synthetic traffic")
+    parser.add_argument("--json", dest="json_path", help="also write the report as JSON to this file")
+    args = parser.parse_args()
+
+    # Databases and logs of the bot are created in a temporary directory, so every run starts from scratch
+    json_path = os.path.abspath(args.json_path) if args.json_path else None
+    with tempfile.TemporaryDirectory() as work_directory:
+        os.chdir(work_directory)
+        configure_logging(os.path.join(work_directory, constants.LOG_FILE_NAME), logging.WARNING)
+        report = asyncio.run(LoadTest(args).run())
+
+    _print_report(report)
+    if json_path:
+        with open(json_path, "w") as json_file:
+            json.dump(report, json_file, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -1,94 +1,270 @@
 import logging
-logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    level=logging.INFO,
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler("telegram_bot.log"),
-    ]
-)
 logger = logging.getLogger(__name__)
 
+import asyncio
+import io
+import json
 import os
+import secrets
+import signal
+import tempfile
+import httpx
 import constants
+import keyboards
 
-from OpenAIClients.ChatGPT.chat_gpt_client import ChatGPTClient, TextDavinciClient
-from OpenAIClients.DALLE.dalle_client import DALLEClient, ImageRequestData, ImageSize
-from OpenAIClients.WhisperClient.whisper_client import WhisperClient
+from OpenAIService.chat_session import ChatSession
+from OpenAIService.openai_service import OpenAIService
+from OpenAIService.connection_pool import OpenAIConnectionPool
+from OpenAIService.completion_cache import CompletionCache
+from OpenAIService.request_scheduler import RequestExpiredError
+from OpenAIService.media_transcriber import MediaTranscriber
 
 from DBService.db_service import ApiKeysDatabaseService
+from DBService.chat_data_persistence import ChatDataPersistence
+from DBService.transcription_cache import TranscriptionCacheService
+from DBService.image_cache import ImageCacheService
 from chat_state import ChatState
-
-from telegram import ReplyKeyboardRemove, Update, ReplyKeyboardMarkup, InputMediaPhoto
+from update_processor import ChatOrderedUpdateProcessor
+from progressive_message import ProgressiveMessage
+from chat_action import ChatActionSender
+from chat_operations import ChatOperations, OperationCancelledError, OperationTimeoutError
+from bot_api_calls import BotApiCallsCounter, BotApiCallsCountingRequest
+from webhook_server import WebhookServer
+from webhook_router import WebhookRouter
+from log_config import configure_logging
+from metrics import REGISTRY, Histogram
+from metrics_server import MetricsServer
+
+from telegram import Update, ReplyKeyboardMarkup, InputMediaPhoto
+from telegram.constants import ChatAction
 from telegram.ext import filters, ApplicationBuilder, CommandHandler, ContextTypes, MessageHandler
 
+_handler_latency = Histogram("telegram_handler_duration_seconds", "Duration of Telegram update handlers", ("handler",))
+
 class ChatGPTBot:
-    def __init__(self, token):
+    def __init__(self, token, metrics_port: int | None = None, api_keys_cache_ttl: float = constants.API_KEYS_CACHE_TTL_SECONDS):
         db_encryption_key = os.getenv(constants.API_KEYS_DB_ENCRYPTION_KEY_ENV)
         if not db_encryption_key:
             logger.error(f"{constants.API_KEYS_DB_ENCRYPTION_KEY_ENV} was not found in environment variables.")
-        self._db_service = ApiKeysDatabaseService(db_encryption_key, "api_keys.db")
-        self._application = ApplicationBuilder().token(token).build()
+        self._db_service = ApiKeysDatabaseService(db_encryption_key, "api_keys.db", api_keys_cache_ttl)
+        self._transcription_cache = TranscriptionCacheService()
+        self._image_cache = ImageCacheService()
+        self._stream_assistant_replies = os.getenv(constants.STREAM_ASSISTANT_REPLIES_ENV, "1") != "0"
+        self._chat_action_max_repeats = int(os.getenv(constants.CHAT_ACTION_MAX_REPEATS_ENV, constants.DEFAULT_CHAT_ACTION_MAX_REPEATS))
+        connection_pool = OpenAIConnectionPool(
+            int(os.getenv(constants.OPENAI_MAX_CONNECTIONS_ENV, constants.DEFAULT_OPENAI_MAX_CONNECTIONS)),
+            float(os.getenv(constants.OPENAI_KEEPALIVE_EXPIRY_ENV, constants.DEFAULT_OPENAI_KEEPALIVE_EXPIRY_SECONDS)),
+            float(os.getenv(constants.OPENAI_CONNECT_TIMEOUT_ENV, constants.DEFAULT_OPENAI_CONNECT_TIMEOUT_SECONDS)),
+            float(os.getenv(constants.OPENAI_REQUEST_TIMEOUT_ENV, constants.OPENAI_REQUEST_TIMEOUT_SECONDS)),
+            os.getenv(constants.OPENAI_HTTP2_ENV, "1") != "0",
+            os.getenv(constants.OPENAI_API_BASE_URL_ENV, constants.OPENAI_API_BASE_URL)
+        )
+        self._openai_service = OpenAIService(
+            connection_pool,
+            int(os.getenv(constants.CHAT_HISTORY_MAX_TOKENS_ENV, constants.DEFAULT_CHAT_HISTORY_MAX_TOKENS)),
+            os.getenv(constants.CHAT_HISTORY_SUMMARIZATION_ENV, "0") == "1",
+            CompletionCache() if os.getenv(constants.COMPLETION_CACHE_ENABLED_ENV, "0") == "1" else None
+        )
+        self._media_transcriber = MediaTranscriber(
+            self._openai_service,
+            max_concurrent_segments=int(os.getenv(constants.MAX_CONCURRENT_TRANSCRIPTION_SEGMENTS_ENV, constants.DEFAULT_MAX_CONCURRENT_TRANSCRIPTION_SEGMENTS))
+        )
+        self._bot_api_calls_counter = BotApiCallsCounter()
+        self._chat_operations = ChatOperations()
+        self._update_processor = ChatOrderedUpdateProcessor(
+            int(os.getenv(constants.MAX_CONCURRENT_UPDATES_ENV, constants.DEFAULT_MAX_CONCURRENT_UPDATES)),
+            int(os.getenv(constants.MAX_CHAT_QUEUE_SIZE_ENV, constants.DEFAULT_MAX_CHAT_QUEUE_SIZE)),
+            self._bot_api_calls_counter,
+            self._cancel_chat_operation_if_requested
+        )
+        self._persistence = ChatDataPersistence()
+        telegram_api_server = os.getenv(constants.TELEGRAM_API_SERVER_ENV, constants.DEFAULT_TELEGRAM_API_SERVER)
+        self._idle_chat_data_sweeper = None
+        self._metrics_server = MetricsServer(constants.METRICS_HOST, metrics_port) if metrics_port else None
+        self._register_metrics()
+        self._application = (
+            ApplicationBuilder()
+            .token(token)
+            .base_url(f"{telegram_api_server}/bot")
+            .base_file_url(f"{telegram_api_server}/file/bot")
+            .request(BotApiCallsCountingRequest(self._bot_api_calls_counter, connection_pool_size=constants.TELEGRAM_CONNECTION_POOL_SIZE))
+            .concurrent_updates(self._update_processor)
+            .persistence(self._persistence)
+            .post_init(self._post_init)
+            .post_stop(self._post_stop)
+            .post_shutdown(self._post_shutdown)
+            .build()
+        )
         self._configure_handlers()
 
-    def __del__(self):
-        logger.info("Bot ended polling updates")
+    @property
+    def application(self):
+        return self._application
+
+    @property
+    def bot_api_calls_counter(self) -> BotApiCallsCounter:
+        return self._bot_api_calls_counter
+
+    def _register_metrics(self):
+        REGISTRY.register_stats("updates", lambda: self._update_processor.stats)
+        REGISTRY.register_stats("chat", lambda: self._chat_operations.stats)
+        REGISTRY.register_stats("telegram_api", lambda: self._bot_api_calls_counter.stats)
+        REGISTRY.register_stats("openai", lambda: self._openai_service.stats)
+        if self._openai_service.completion_cache:
+            REGISTRY.register_stats("completion_cache", lambda: self._openai_service.completion_cache.stats)
+        REGISTRY.register_stats("transcription_cache", lambda: self._transcription_cache.stats)
+        REGISTRY.register_stats("image_cache", lambda: self._image_cache.stats)
+        REGISTRY.register_stats("api_keys", lambda: self._db_service.stats)
 
     def run(self):
         logger.info("Bot started polling updates")
         self._application.run_polling()
+        # Logged here instead of __del__, which may run when the logging queue is already stopped
+        logger.info("Bot ended polling updates")
+
+    def run_webhook(self, host: str, port: int, secret_token: str, webhook_url: str | None = None):
+        # Without webhook_url the bot works as a worker behind WebhookRouter, which sets the webhook itself
+        logger.info(f"Bot started serving webhook updates on {host}:{port}")
+        asyncio.run(self._serve_webhook(host, port, secret_token, webhook_url))
+
+    async def _serve_webhook(self, host: str, port: int, secret_token: str, webhook_url: str | None):
+        stop_event = asyncio.Event()
+        for stop_signal in (signal.SIGINT, signal.SIGTERM):
+            asyncio.get_running_loop().add_signal_handler(stop_signal, stop_event.set)
+
+        server = WebhookServer(host, port, secret_token, self._put_webhook_update)
+        async with self._application:
+            await self._post_init(self._application)
+            await self._application.start()
+            await server.start()
+            if webhook_url:
+                await self._application.bot.set_webhook(webhook_url, secret_token=secret_token)
+            await stop_event.wait()
+            await server.stop()
+            await self._application.stop()
+            await self._post_stop(self._application)
+        await self._post_shutdown(self._application)
+
+    async def _put_webhook_update(self, body: bytes):
+        await self._application.update_queue.put(Update.de_json(json.loads(body), self._application.bot))
+
+    async def _post_init(self, application):
+        self._idle_chat_data_sweeper = asyncio.create_task(self._evict_idle_chat_data())
+        if self._metrics_server:
+            await self._metrics_server.start()
+
+    async def _post_stop(self, application):
+        self._idle_chat_data_sweeper.cancel()
+        if self._metrics_server:
+            await self._metrics_server.stop()
+
+    async def _post_shutdown(self, application):
+        logger.info(f"Bot API calls stats: {self._bot_api_calls_counter.stats}")
+        logger.info(f"OpenAI connection pool stats: {self._openai_service.stats}")
+        if self._openai_service.completion_cache:
+            logger.info(f"Completion cache stats: {self._openai_service.completion_cache.stats}")
+        await self._openai_service.close()
+        self._db_service.close()
+        self._transcription_cache.close()
+        self._image_cache.close()
+
+    async def _evict_idle_chat_data(self):
+        # Keeps only chat data of active users in memory, idle chats are loaded back from persistence on their next update
+        while True:
+            await asyncio.sleep(constants.CHAT_DATA_SWEEP_INTERVAL_SECONDS)
+            evicted_count = 0
+            for chat_id in self._persistence.idle_chat_ids(constants.CHAT_DATA_IDLE_TTL_SECONDS):
+                if not self._update_processor.has_pending_updates(chat_id):
+                    self._persistence.evict_chat_data(chat_id)
+                    self._application.drop_chat_data(chat_id)
+                    evicted_count += 1
+            if evicted_count:
+                logger.info(f"Evicted {evicted_count} idle chats")
 
     def _configure_handlers(self):
         # Command handlers
-        self._application.add_handler(CommandHandler("start", self._start_handler))
+        self._application.add_handler(CommandHandler("start", self._timed(self._start_handler)))
 
         # Media handlers
-        self._application.add_handler(MessageHandler(filters.VOICE | filters.AUDIO | filters.VIDEO | filters.VIDEO_NOTE, self._media_message_handler))
-
-        # Menu hendlers
-        self._application.add_handler(MessageHandler(filters.Regex(r'^Set API Key 🔑$'), self._api_key_handler))
-        self._application.add_handler(MessageHandler(filters.Regex(r'^Cancel ❌$'), self._cancel_handler))
-        self._application.add_handler(MessageHandler(filters.Regex(r'^Help ℹ️$'), self._help_handler))
-        self._application.add_handler(MessageHandler(filters.Regex(r'^Start Chat With Assistant 💬$'), self._start_chat_handler))
-        self._application.add_handler(MessageHandler(filters.Regex(r'^\w* (👨‍⚕️|👨‍🍳|🤖|🏆|👨‍🔬|😂)$'), self._assistant_role_handler))
-        self._application.add_handler(MessageHandler(filters.Regex(r'^End Chat ❌$'), self._end_chat_handler))
-        self._application.add_handler(MessageHandler(filters.Regex(r'^Generate Image 🖼️$'), self._generate_image_handler))
-        self._application.add_handler(MessageHandler(filters.Regex(r'^(1️⃣|2️⃣|3️⃣|4️⃣)$'), self._image_count_handler))
-        self._application.add_handler(MessageHandler(filters.Regex(r'^(Small|Medium|Large)$'), self._image_size_handler))
-        self._application.add_handler(MessageHandler(filters.Regex(r'^Transcript Media 🎧$'), self._transcript_media_handler))
-
-        # Message handlers
-        self._application.add_handler(MessageHandler(filters.TEXT & (~filters.COMMAND), self._message_handler))
+        self._application.add_handler(MessageHandler(filters.VOICE | filters.AUDIO | filters.VIDEO | filters.VIDEO_NOTE, self._timed(self._media_message_handler)))
+
+        # Menu and message handlers
+        self._application.add_handler(MessageHandler(filters.TEXT & (~filters.COMMAND), self._text_message_handler))
 
         # Error handlers
         self._application.add_error_handler(self._error_handler)
 
-    def _openai_api_key_provided(self, user_id: int, context: ContextTypes.DEFAULT_TYPE) -> bool:
-        if constants.API_KEY_FIELD not in context.user_data:
-            api_key = self._db_service.get_api_key(user_id)
-            if api_key:
-                context.user_data[constants.API_KEY_FIELD] = api_key
-            else:
-                return False
-        return True
-
-    def _get_openai_api_key(self, user_id: int, context: ContextTypes.DEFAULT_TYPE) -> str | None:
-        return context.user_data[constants.API_KEY_FIELD].strip() if self._openai_api_key_provided(user_id, context) else None
+        # Menu buttons are looked up by (text, ChatState), None state means that the button works in any state.
+        # Text which is not a menu button in the current state goes to _message_handler.
+        self._menu_handlers = {}
+        self._add_menu_handler(constants.SET_API_KEY_BUTTON, self._api_key_handler)
+        self._add_menu_handler(constants.CANCEL_BUTTON, self._cancel_handler)
+        self._add_menu_handler(constants.HELP_BUTTON, self._help_handler)
+        self._add_menu_handler(constants.START_CHAT_BUTTON, self._start_chat_handler)
+        self._add_menu_handler(constants.ASSISTANT_ROLES_BUTTONS, self._assistant_role_handler)
+        self._add_menu_handler(constants.GENERATE_IMAGE_BUTTON, self._generate_image_handler)
+        self._add_menu_handler(constants.TRANSCRIPT_MEDIA_BUTTON, self._transcript_media_handler)
+        self._add_menu_handler(constants.END_CHAT_BUTTON, self._end_chat_handler, ChatState.HAVING_CONVERSATION_WITH_ASSISTANT)
+        self._add_menu_handler(constants.IMAGE_COUNT_BUTTONS, self._image_count_handler, ChatState.SELECTING_IMAGES_COUNT)
+        self._add_menu_handler(constants.IMAGE_SIZE_BUTTONS, self._image_size_handler, ChatState.SELECTING_IMAGES_SIZE)
+
+    def _add_menu_handler(self, buttons: list, handler, state: ChatState | None = None):
+        for row in buttons:
+            for button in row:
+                self._menu_handlers[(button.text, state)] = handler
+
+    async def _text_message_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        text = update.effective_message.text
+        handler = (
+            self._menu_handlers.get((text, self._get_chat_state(context)))
+            or self._menu_handlers.get((text, None))
+            or self._message_handler
+        )
+        with _handler_latency.time(handler.__name__.lstrip("_")):
+            await handler(update, context)
+
+    @staticmethod
+    def _timed(handler):
+        async def timed_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+            with _handler_latency.time(handler.__name__.lstrip("_")):
+                await handler(update, context)
+        return timed_handler
+
+    def _cancel_chat_operation_if_requested(self, update: object):
+        # Cancel and End Chat would wait for the operation they have to abort, so it is cancelled as soon as they are received
+        if isinstance(update, Update) and update.effective_chat and update.effective_message:
+            if update.effective_message.text in (constants.CANCEL_BUTTON[0][0].text, constants.END_CHAT_BUTTON[0][0].text):
+                self._chat_operations.cancel(update.effective_chat.id)
+
+    def _chat_action(self, update: Update, action: str) -> ChatActionSender:
+        return ChatActionSender(update.effective_chat, action, max_repeats=self._chat_action_max_repeats)
+
+    async def _run_operation(self, update: Update, coroutine, timeout: float):
+        return await self._chat_operations.run(update.effective_chat.id, coroutine, timeout)
+
+    async def _openai_api_key_provided(self, user_id: int, context: ContextTypes.DEFAULT_TYPE) -> bool:
+        return await self._get_openai_api_key(user_id, context) is not None
+
+    async def _get_openai_api_key(self, user_id: int, context: ContextTypes.DEFAULT_TYPE) -> str | None:
+        # Keys are always read through the database service, not kept in user_data, so a key replaced
+        # in another webhook worker is picked up as soon as the cached one expires
+        api_key = await self._db_service.get_api_key(user_id)
+        return api_key.strip() if api_key else None
 
     async def _start_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.info(f"_start_handler called for User {update.effective_user.id}")
 
         reply_message = constants.WELCOME_USER_MESSAGE
-        keyboard = constants.MAIN_BUTTONS
-        if not self._openai_api_key_provided(update.effective_user.id, context):
+        menu = keyboards.MAIN_MENU
+        if not await self._openai_api_key_provided(update.effective_user.id, context):
             reply_message += f" {constants.API_KEY_REQUEST_MESSAGE}"
-            keyboard = constants.SET_API_KEY_BUTTON
-        await self._answer_and_update_menu(update, keyboard, reply_message)
+            menu = keyboards.SET_API_KEY_MENU
+        await self._answer_and_update_menu(update, menu, reply_message)
 
     async def _api_key_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.info(f"_api_key_handler called for User {update.effective_user.id}")
 
-        await self._answer_and_update_menu(update, constants.CANCEL_BUTTON, constants.PLEASE_SEND_API_KEY_MESSAGE)
+        await self._answer_and_update_menu(update, keyboards.CANCEL_MENU, constants.PLEASE_SEND_API_KEY_MESSAGE)
         self._set_chat_state(ChatState.PROVIDING_API_KEY, context)
 
     async def _cancel_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -96,104 +272,113 @@ class ChatGPTBot:
         logger.info(f"_cancel_handler called for User {user_id}")
 
         self._set_chat_state(ChatState.MAIN, context)
-        if self._openai_api_key_provided(user_id, context):
-            await self._answer_and_update_menu(update, constants.MAIN_BUTTONS)
+        if await self._openai_api_key_provided(user_id, context):
+            await self._answer_and_update_menu(update, keyboards.MAIN_MENU)
         else:
-            await self._answer_and_update_menu(update, constants.SET_API_KEY_BUTTON)
+            await self._answer_and_update_menu(update, keyboards.SET_API_KEY_MENU)
 
     async def _start_chat_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.effective_user.id
         logger.info(f"_start_chat_handler called for User {user_id}")
 
-        if not self._openai_api_key_provided(user_id, context):
-            await self._answer_and_update_menu(update, constants.SET_API_KEY_BUTTON, constants.SOMETHING_WENT_WRONG_MESSAGE + constants.API_KEY_REQUEST_MESSAGE)
+        if not await self._openai_api_key_provided(user_id, context):
+            await self._answer_and_update_menu(update, keyboards.SET_API_KEY_MENU, constants.SOMETHING_WENT_WRONG_MESSAGE + constants.API_KEY_REQUEST_MESSAGE)
         else:
-            await self._answer_and_update_menu(update, constants.ASSISTANT_ROLES_BUTTONS + constants.CANCEL_BUTTON, constants.ASSISTANT_ROLE_REQUEST_MESSAGE)
+            await self._answer_and_update_menu(update, keyboards.ASSISTANT_ROLES_MENU, constants.ASSISTANT_ROLE_REQUEST_MESSAGE)
             self._set_chat_state(ChatState.SELECTING_ASSISTANT_ROLE, context)
 
     async def _assistant_role_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.effective_user.id
         logger.info(f"_assistant_role_handler called for User {user_id}")
 
-        if not self._openai_api_key_provided(user_id, context):
-            await self._answer_and_update_menu(update, constants.SET_API_KEY_BUTTON, constants.SOMETHING_WENT_WRONG_MESSAGE + constants.API_KEY_REQUEST_MESSAGE)
+        if not await self._openai_api_key_provided(user_id, context):
+            await self._answer_and_update_menu(update, keyboards.SET_API_KEY_MENU, constants.SOMETHING_WENT_WRONG_MESSAGE + constants.API_KEY_REQUEST_MESSAGE)
         else:
-            api_key = self._get_openai_api_key(user_id, context)
-            chat_gpt_client = ChatGPTClient(api_key, update.effective_message.text)
-            context.chat_data[constants.CHAT_CLIENT] = chat_gpt_client
-            await self._answer_and_update_menu(update, constants.END_CHAT_BUTTON, constants.CHAT_STARTED_MESSAGE)
+            context.chat_data[constants.CHAT_CLIENT] = ChatSession(update.effective_message.text)
+            await self._answer_and_update_menu(update, keyboards.END_CHAT_MENU, constants.CHAT_STARTED_MESSAGE)
             self._set_chat_state(ChatState.HAVING_CONVERSATION_WITH_ASSISTANT, context)
 
     async def _end_chat_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.info(f"_end_chat_handler called for User {update.effective_user.id}")
 
-        if self._get_chat_state(context) == ChatState.HAVING_CONVERSATION_WITH_ASSISTANT:
-            del context.chat_data[constants.CHAT_CLIENT]
-            await self._answer_and_update_menu(update, constants.MAIN_BUTTONS, constants.CHAT_ENDED_MESSAGE)
-            self._set_chat_state(ChatState.MAIN, context)
-        else:
-            await self._message_handler(update, context)
+        del context.chat_data[constants.CHAT_CLIENT]
+        await self._answer_and_update_menu(update, keyboards.MAIN_MENU, constants.CHAT_ENDED_MESSAGE)
+        self._set_chat_state(ChatState.MAIN, context)
 
     async def _generate_image_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.effective_user.id
         logger.info(f"_generate_image_handler called for User {user_id}")
 
-        if not self._openai_api_key_provided(user_id, context):
-            await self._answer_and_update_menu(update, constants.SET_API_KEY_BUTTON, constants.SOMETHING_WENT_WRONG_MESSAGE + constants.API_KEY_REQUEST_MESSAGE)
+        if not await self._openai_api_key_provided(user_id, context):
+            await self._answer_and_update_menu(update, keyboards.SET_API_KEY_MENU, constants.SOMETHING_WENT_WRONG_MESSAGE + constants.API_KEY_REQUEST_MESSAGE)
         else:
-            await self._answer_and_update_menu(update, constants.CANCEL_BUTTON, constants.IMAGE_DESCRIPTION_REQUEST_MESSAGE)
+            await self._answer_and_update_menu(update, keyboards.CANCEL_MENU, constants.IMAGE_DESCRIPTION_REQUEST_MESSAGE)
             self._set_chat_state(ChatState.PROVIDING_IMAGES_DESCRIPTION, context)
 
     async def _image_count_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.effective_user.id
         logger.info(f"_image_count_handler called for User {user_id}")
 
-        if self._get_chat_state(context) == ChatState.SELECTING_IMAGES_COUNT:
-            count = 1
-            for button in constants.IMAGE_COUNT_BUTTONS[0] + constants.IMAGE_COUNT_BUTTONS[1]:
-                if update.effective_message.text == button.text:
-                    break
-                else:
-                    count += 1
-            context.chat_data[constants.IMAGES_COUNT_KEY] = count
+        context.chat_data[constants.IMAGES_COUNT_KEY] = constants.IMAGE_COUNTS[update.effective_message.text]
 
-            await self._answer_and_update_menu(update, constants.IMAGE_SIZE_BUTTONS + constants.CANCEL_BUTTON, constants.IMAGE_SIZE_REQUEST_MESSAGE)
-            self._set_chat_state(ChatState.SELECTING_IMAGES_SIZE, context)
-        else:
-            await self._message_handler(update, context)
+        await self._answer_and_update_menu(update, keyboards.IMAGE_SIZE_MENU, constants.IMAGE_SIZE_REQUEST_MESSAGE)
+        self._set_chat_state(ChatState.SELECTING_IMAGES_SIZE, context)
 
     async def _image_size_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.effective_user.id
         logger.info(f"_image_size_handler called for User {user_id}")
 
-        if self._get_chat_state(context) == ChatState.SELECTING_IMAGES_SIZE:
-            size = update.effective_message.text
-            api_key = self._get_openai_api_key(user_id, context)
-            description, count, size = context.chat_data[constants.IMAGES_DESCRIPTION_KEY], context.chat_data[constants.IMAGES_COUNT_KEY], ImageSize[size.upper()]
-            images_data = ImageRequestData(description, count, size)
-
-            please_wait_message = await update.effective_message.reply_text(constants.IMAGE_GENERATION_IN_PROGRESS_MESSAGE)
-            await self._hide_menu(update)
-            image_urls = DALLEClient.generate_images(api_key, images_data)
-            if image_urls:
-                input_media_photos = [InputMediaPhoto(url) for url in image_urls]
-                await context.bot.send_media_group(chat_id=update.effective_chat.id, media=input_media_photos)
-                await self._answer_and_update_menu(update, constants.MAIN_BUTTONS, constants.HERE_ARE_YOUR_IMAGES_MESSAGE)
-                self._set_chat_state(ChatState.MAIN, context)
-            else:
-                await self._answer_and_update_menu(update, constants.IMAGE_SIZE_BUTTONS + constants.CANCEL_BUTTON, constants.SOMETHING_WENT_WRONG_MESSAGE)
-            await please_wait_message.delete()
+        api_key = await self._get_openai_api_key(user_id, context)
+        description, count, size = context.chat_data[constants.IMAGES_DESCRIPTION_KEY], context.chat_data[constants.IMAGES_COUNT_KEY], constants.IMAGE_SIZES[update.effective_message.text]
+
+        # Images generated earlier for the same description and size are resent by file_id, only the missing ones are generated
+        cached_file_ids = await self._image_cache.get_images(description, size)
+        file_ids = cached_file_ids[:count]
+        if file_ids:
+            await self._send_photos(update, file_ids)
+        if len(file_ids) < count:
+            file_ids += await self._run_operation(
+                update,
+                self._send_generated_images(update, api_key, description, count - len(file_ids), size, cached_file_ids),
+                constants.IMAGE_GENERATION_TIMEOUT_SECONDS
+            )
+        if len(file_ids) == count:
+            await self._answer_and_update_menu(update, keyboards.MAIN_MENU, constants.HERE_ARE_YOUR_IMAGES_MESSAGE)
+            self._set_chat_state(ChatState.MAIN, context)
+        elif file_ids:
+            await self._answer_and_update_menu(update, keyboards.MAIN_MENU, constants.FEWER_IMAGES_MESSAGE.format(generated_count=len(file_ids), count=count))
+            self._set_chat_state(ChatState.MAIN, context)
+        else:
+            await self._answer_and_update_menu(update, keyboards.IMAGE_SIZE_MENU, constants.SOMETHING_WENT_WRONG_MESSAGE)
+
+    async def _send_generated_images(self, update: Update, api_key: str, description: str, count: int, size: str, cached_file_ids: list[str]) -> list[str]:
+        generated_file_ids = []
+        try:
+            async with self._chat_action(update, ChatAction.UPLOAD_PHOTO):
+                # Every image is sent as soon as it is generated instead of waiting for all of them
+                async for image_url in self._openai_service.generate_images(api_key, description, count, size):
+                    message = await update.effective_chat.send_photo(image_url)
+                    generated_file_ids.append(message.photo[-1].file_id)
+        finally:
+            # Images which were sent before a cancellation or an error are cached as well
+            if generated_file_ids:
+                await self._image_cache.store_images(description, size, cached_file_ids + generated_file_ids)
+        return generated_file_ids
+
+    async def _send_photos(self, update: Update, file_ids: list[str]):
+        if len(file_ids) == 1:
+            await update.effective_chat.send_photo(file_ids[0])
         else:
-            await self._message_handler(update, context)
+            await update.effective_chat.send_media_group([InputMediaPhoto(file_id) for file_id in file_ids])
 
     async def _transcript_media_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.effective_user.id
         logger.info(f"_transcript_media_handler called for User {user_id}") 
 
-        if not self._openai_api_key_provided(user_id, context):
-            await self._answer_and_update_menu(update, constants.SET_API_KEY_BUTTON, constants.SOMETHING_WENT_WRONG_MESSAGE + constants.API_KEY_REQUEST_MESSAGE)
+        if not await self._openai_api_key_provided(user_id, context):
+            await self._answer_and_update_menu(update, keyboards.SET_API_KEY_MENU, constants.SOMETHING_WENT_WRONG_MESSAGE + constants.API_KEY_REQUEST_MESSAGE)
         else:
-            await self._answer_and_update_menu(update, constants.CANCEL_BUTTON, constants.MEDIA_FILE_REQUEST_MESSAGE)
+            await self._answer_and_update_menu(update, keyboards.CANCEL_MENU, constants.MEDIA_FILE_REQUEST_MESSAGE)
             self._set_chat_state(ChatState.PROVIDING_MEDIA_FILE, context)
 
     async def _media_message_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -201,56 +386,82 @@ class ChatGPTBot:
         logger.info(f"_handle_audio_video_message called for User {user_id}")
 
         chat_state = self._get_chat_state(context)
-        if not self._openai_api_key_provided(user_id, context):
-            await self._answer_and_update_menu(update, constants.SET_API_KEY_BUTTON, constants.SOMETHING_WENT_WRONG_MESSAGE + constants.API_KEY_REQUEST_MESSAGE)
+        if not await self._openai_api_key_provided(user_id, context):
+            await self._answer_and_update_menu(update, keyboards.SET_API_KEY_MENU, constants.SOMETHING_WENT_WRONG_MESSAGE + constants.API_KEY_REQUEST_MESSAGE)
         elif chat_state in [ChatState.PROVIDING_MEDIA_FILE, ChatState.MAIN, ChatState.HAVING_CONVERSATION_WITH_ASSISTANT]:
             # Check if the message contains a voice message, audio, or video file
             if update.effective_message.voice:
-                file_id = update.message.voice.file_id
+                media = update.effective_message.voice
                 extension = 'ogg'
             elif update.effective_message.audio:
-                file_id = update.message.audio.file_id
+                media = update.effective_message.audio
                 extension = 'mp3'
             elif update.effective_message.video:
-                file_id = update.message.video.file_id
+                media = update.effective_message.video
                 extension = 'mp4'
             elif update.effective_message.video_note:
-                file_id = update.message.video_note.file_id
+                media = update.effective_message.video_note
                 extension = 'mp4'
             else:
                 await update.effective_message.reply_text(constants.MEDIA_FILE_REQUEST_MESSAGE)
                 return
 
-            # Download the file
-            file = await context.bot.get_file(file_id)
-            media_filename = f"user_media_{user_id}.{extension}"
-            await file.download_to_drive(media_filename)
-            api_key = self._get_openai_api_key(user_id, context)
+            if media.file_size and media.file_size > constants.MAX_MEDIA_FILE_SIZE:
+                await update.effective_message.reply_text(constants.MEDIA_FILE_TOO_LARGE_MESSAGE)
+                return
 
-            if chat_state == ChatState.PROVIDING_MEDIA_FILE:
-                please_wait_message = await update.effective_message.reply_text(constants.TRANSCRIPTION_IN_PROGRESS_MESSAGE)
-            elif update.effective_message.voice and chat_state in [ChatState.MAIN, ChatState.HAVING_CONVERSATION_WITH_ASSISTANT]:
-                please_wait_message = await update.effective_message.reply_text(constants.ASSISTANT_IS_ANSWERING_MESSAGE)
+            api_key = await self._get_openai_api_key(user_id, context)
 
-            transcription = WhisperClient.transcript_media_file(api_key, f"{media_filename}")
             if chat_state == ChatState.PROVIDING_MEDIA_FILE:
-                await self._answer_and_update_menu(update, constants.MAIN_BUTTONS, transcription)
-            elif chat_state == ChatState.MAIN and update.effective_message.voice:
-                answer = TextDavinciClient.ask_question(api_key, transcription)
-                await update.effective_message.reply_text(answer)
-            elif chat_state == ChatState.HAVING_CONVERSATION_WITH_ASSISTANT and update.effective_message.voice:
-                chat_gpt_client = context.chat_data[constants.CHAT_CLIENT]
-                response = chat_gpt_client.ask_chat(transcription)
-                await update.effective_message.reply_text(response)
-
-            await please_wait_message.delete()
-
-            # Remove temporary files
-            os.remove(media_filename)
-        
+                # Long media are transcribed by segments, so the beginning of the text is shown while the rest is in progress
+                progressive_message = ProgressiveMessage(update.effective_message)
+                async with self._chat_action(update, ChatAction.TYPING) as chat_action:
+                    async def on_progress(text: str):
+                        await chat_action.stop()
+                        await progressive_message.update(text)
+                    transcription = await self._run_operation(
+                        update,
+                        self._transcript_media(context, api_key, media, extension, on_progress),
+                        constants.TRANSCRIPTION_TIMEOUT_SECONDS
+                    )
+                if not await progressive_message.finish(transcription, keyboards.MAIN_MENU):
+                    await self._answer_and_update_menu(update, keyboards.MAIN_MENU)
+            elif update.effective_message.voice:
+                async with self._chat_action(update, ChatAction.TYPING):
+                    transcription = await self._run_operation(
+                        update,
+                        self._transcript_media(context, api_key, media, extension),
+                        constants.TRANSCRIPTION_TIMEOUT_SECONDS
+                    )
+                if chat_state == ChatState.MAIN:
+                    await self._answer_question(update, api_key, transcription)
+                else:
+                    chat_session = context.chat_data[constants.CHAT_CLIENT]
+                    await self._answer_in_chat(update, api_key, chat_session, transcription)
+            else:
+                await update.effective_message.reply_text(constants.TRANSCRIPT_MEDIA_HELP)
+
         else:
             await update.effective_message.reply_text(constants.TRANSCRIPT_MEDIA_HELP)
 
+    async def _transcript_media(self, context: ContextTypes.DEFAULT_TYPE, api_key: str, media, extension: str, on_progress=None) -> str:
+        # Forwarded and re-sent media have the same file_unique_id, so they are neither downloaded nor transcribed again
+        transcription = await self._transcription_cache.get_transcription(media.file_unique_id)
+        if transcription is not None:
+            return transcription
+
+        # Media is downloaded to memory, only large or unknown size files go to an anonymous temporary file
+        # which is removed by the system as soon as it is closed, even if the transcription fails
+        file = await context.bot.get_file(media.file_id)
+        in_memory = media.file_size and media.file_size <= constants.MAX_IN_MEMORY_MEDIA_FILE_SIZE
+        with io.BytesIO() if in_memory else tempfile.TemporaryFile() as media_file:
+            await file.download_to_memory(media_file)
+            media_file.seek(0)
+            transcription = await self._media_transcriber.transcript(api_key, media_file, extension, media.duration, on_progress)
+
+        await self._transcription_cache.store_transcription(media.file_unique_id, transcription)
+        return transcription
+
     async def _message_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.effective_user.id
         message = update.message.text
@@ -258,61 +469,82 @@ class ChatGPTBot:
 
         chat_state = self._get_chat_state(context)
         if chat_state == ChatState.MAIN:
-            if self._openai_api_key_provided(user_id, context):
-                please_wait_message = await update.effective_message.reply_text(constants.ASSISTANT_IS_ANSWERING_MESSAGE)
-                api_key = self._get_openai_api_key(user_id, context)
-                answer = TextDavinciClient.ask_question(api_key, message)
-                await update.effective_message.reply_text(answer)
-                await please_wait_message.delete()
+            if await self._openai_api_key_provided(user_id, context):
+                api_key = await self._get_openai_api_key(user_id, context)
+                await self._answer_question(update, api_key, message)
             else:
-                await self._answer_and_update_menu(update, constants.SET_API_KEY_BUTTON, constants.API_KEY_REQUEST_MESSAGE)
+                await self._answer_and_update_menu(update, keyboards.SET_API_KEY_MENU, constants.API_KEY_REQUEST_MESSAGE)
 
         elif chat_state == ChatState.PROVIDING_API_KEY:
-            api_key = message
-            context.user_data[constants.API_KEY_FIELD] = api_key
-            self._db_service.store_api_key(user_id, api_key)
-            await self._answer_and_update_menu(update, constants.MAIN_BUTTONS, constants.API_KEY_SET_SUCCESSFULLY_MESSAGE)
+            await self._db_service.store_api_key(user_id, message)
+            await self._answer_and_update_menu(update, keyboards.MAIN_MENU, constants.API_KEY_SET_SUCCESSFULLY_MESSAGE)
             self._set_chat_state(ChatState.MAIN, context)
 
         elif chat_state == ChatState.PROVIDING_IMAGES_DESCRIPTION:
             context.chat_data[constants.IMAGES_DESCRIPTION_KEY] = message
-            await self._answer_and_update_menu(update, constants.IMAGE_COUNT_BUTTONS + constants.CANCEL_BUTTON, constants.IMAGE_COUNT_REQUEST_MESSAGE)
+            await self._answer_and_update_menu(update, keyboards.IMAGE_COUNT_MENU, constants.IMAGE_COUNT_REQUEST_MESSAGE)
             self._set_chat_state(ChatState.SELECTING_IMAGES_COUNT, context)
 
         elif chat_state == ChatState.SELECTING_ASSISTANT_ROLE:
             await self._assistant_role_handler(update, context)
 
         elif chat_state == ChatState.HAVING_CONVERSATION_WITH_ASSISTANT:
-            chat_gpt_client = context.chat_data[constants.CHAT_CLIENT]
-            please_wait_message = await update.effective_message.reply_text(constants.ASSISTANT_IS_ANSWERING_MESSAGE)
-            response = chat_gpt_client.ask_chat(update.effective_message.text)
-            await update.effective_message.reply_text(response)
-            await please_wait_message.delete()
+            chat_session = context.chat_data[constants.CHAT_CLIENT]
+            api_key = await self._get_openai_api_key(user_id, context)
+            await self._answer_in_chat(update, api_key, chat_session, message)
 
         else:
             await update.effective_message.reply_text(constants.BOT_MENU_HELP_MESSAGE)
 
+    async def _answer_question(self, update: Update, api_key: str, question: str):
+        async with self._chat_action(update, ChatAction.TYPING):
+            answer = await self._run_operation(update, self._openai_service.ask_question(api_key, question), constants.ANSWER_TIMEOUT_SECONDS)
+        await update.effective_message.reply_text(answer)
+
+    async def _answer_in_chat(self, update: Update, api_key: str, chat_session: ChatSession, message: str):
+        await self._run_operation(update, self._generate_chat_answer(update, api_key, chat_session, message), constants.ANSWER_TIMEOUT_SECONDS)
+
+    async def _generate_chat_answer(self, update: Update, api_key: str, chat_session: ChatSession, message: str):
+        if self._stream_assistant_replies:
+            # The answer is sent with its first chunk and then edited in place as it is generated
+            answer = ""
+            progressive_message = ProgressiveMessage(update.effective_message)
+            async with self._chat_action(update, ChatAction.TYPING) as chat_action:
+                async for chunk in self._openai_service.stream_chat(api_key, chat_session, message):
+                    await chat_action.stop()
+                    answer += chunk
+                    await progressive_message.update(answer)
+            await progressive_message.finish(answer.strip())
+        else:
+            async with self._chat_action(update, ChatAction.TYPING):
+                response = await self._openai_service.ask_chat(api_key, chat_session, message)
+            await update.effective_message.reply_text(response)
+
     async def _help_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.info(f"_help_handler called for User {update.effective_user.id}")
 
         await update.message.reply_text(constants.HELP_MESSAGE, parse_mode="HTML")
 
     async def _error_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        if isinstance(context.error, OperationCancelledError):
+            # The update which cancelled the operation answers the user
+            logger.info(f"Update {update.update_id} was cancelled: {context.error}")
+            return
         logger.error("Update '%s' caused error '%s'", update, context.error)
 
         if update and update.effective_message:
-            await update.effective_message.reply_text(constants.TRY_AGAIN_MESSAGE)
+            if isinstance(context.error, (OperationTimeoutError, httpx.TimeoutException)):
+                await update.effective_message.reply_text(constants.OPERATION_TIMED_OUT_MESSAGE)
+            elif isinstance(context.error, RequestExpiredError) or (isinstance(context.error, httpx.HTTPStatusError) and context.error.response.status_code == 429):
+                await update.effective_message.reply_text(constants.OPENAI_IS_BUSY_MESSAGE)
+            else:
+                await update.effective_message.reply_text(constants.TRY_AGAIN_MESSAGE)
 
-    async def _answer_and_update_menu(self, update: Update, keyboard: list, message: str = ""):
+    async def _answer_and_update_menu(self, update: Update, menu: ReplyKeyboardMarkup, message: str = ""):
         logger.info(f"Answering and updating menu for User {update.effective_user.id}")
 
         reply_text = message if len(message) > 0 else "Bot menu has been updated."
-        reply_markup = ReplyKeyboardMarkup(keyboard + constants.HELP_BUTTON, resize_keyboard=True)
-        await update.effective_message.reply_text(reply_text, reply_markup=reply_markup)
-
-    async def _hide_menu(self, update: Update):
-        reply_markup = ReplyKeyboardRemove()
-        await update.effective_message.reply_text("Bot menu temporary hidden.", reply_markup=reply_markup)
+        await update.effective_message.reply_text(reply_text, reply_markup=menu)
 
     def _set_chat_state(self, state: ChatState, context: ContextTypes.DEFAULT_TYPE):
         context.chat_data[constants.CHAT_STATE_FIELD] = state
@@ -324,12 +556,34 @@ class ChatGPTBot:
 
 
 def main():
+    configure_logging()
+    metrics_port = int(os.getenv(constants.METRICS_PORT_ENV, 0)) or None
     bot_token = os.getenv(constants.TELEGRAM_BOT_TOKEN_ENV)
     if not bot_token:
         logger.error(f"{constants.TELEGRAM_BOT_TOKEN_ENV} was not found in environment variables. Stopping the bot.")
         return
-    bot = ChatGPTBot(bot_token)
-    bot.run()
+
+    webhook_url = os.getenv(constants.WEBHOOK_URL_ENV)
+    if not webhook_url:
+        ChatGPTBot(bot_token, metrics_port).run()
+        return
+
+    port = int(os.getenv(constants.WEBHOOK_PORT_ENV, constants.DEFAULT_WEBHOOK_PORT))
+    secret_token = os.getenv(constants.WEBHOOK_SECRET_TOKEN_ENV)
+    if not secret_token:
+        # Telegram gets the token with the webhook, so a random one works as well as a configured one
+        secret_token = secrets.token_urlsafe(32)
+        logger.info(f"{constants.WEBHOOK_SECRET_TOKEN_ENV} was not found in environment variables, a random secret token is used")
+    workers_count = int(os.getenv(constants.WEBHOOK_WORKERS_ENV, constants.DEFAULT_WEBHOOK_WORKERS))
+    if workers_count == 1:
+        ChatGPTBot(bot_token, metrics_port).run_webhook(constants.WEBHOOK_HOST, port, secret_token, webhook_url)
+    else:
+        workers_base_port = int(os.getenv(constants.WEBHOOK_WORKERS_BASE_PORT_ENV, constants.DEFAULT_WEBHOOK_WORKERS_BASE_PORT))
+        WebhookRouter(bot_token, webhook_url, constants.WEBHOOK_HOST, port, secret_token, workers_count, workers_base_port, metrics_port, run_webhook_worker).run()
+
+def run_webhook_worker(bot_token: str, host: str, port: int, secret_token: str, metrics_port: int | None):
+    configure_logging(constants.WORKER_LOG_FILE_NAME.format(port=port))
+    ChatGPTBot(bot_token, metrics_port, constants.WORKER_API_KEYS_CACHE_TTL_SECONDS).run_webhook(host, port, secret_token)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,63 @@
+import contextvars
+import logging
+logger = logging.getLogger(__name__)
+
+from collections import Counter
+from contextlib import contextmanager
+from typing import Callable
+from telegram.request import HTTPXRequest
+
+# Bot API calls made while an update is processed are counted into the Counter of that update.
+# Tasks started by handlers inherit the context, so their calls are counted to the same update.
+_interaction_calls: contextvars.ContextVar[Counter | None] = contextvars.ContextVar("interaction_calls", default=None)
+
+class BotApiCallsCounter:
+    # Records how many Bot API calls every processed update (interaction) costs, so the per-chat
+    # and global Telegram rate limits budget can be verified.
+    def __init__(self):
+        self._interactions_count = 0
+        self._interaction_calls_count = 0
+        self._max_interaction_calls_count = 0
+        self._calls_by_method = Counter()
+        # Called with the update_id and the calls of every finished interaction, e.g. by benchmarks
+        self.on_interaction_finished: Callable[[int | None, Counter], None] | None = None
+
+    @property
+    def stats(self) -> dict:
+        return {
+            "interactions": self._interactions_count,
+            "calls_per_interaction": round(self._interaction_calls_count / max(self._interactions_count, 1), 2),
+            "max_calls_per_interaction": self._max_interaction_calls_count,
+            "calls_by_method": dict(self._calls_by_method)
+        }
+
+    @contextmanager
+    def interaction(self, update_id: int | None = None):
+        calls = Counter()
+        token = _interaction_calls.set(calls)
+        try:
+            yield calls
+        finally:
+            _interaction_calls.reset(token)
+            calls_count = calls.total()
+            self._interactions_count += 1
+            self._interaction_calls_count += calls_count
+            self._max_interaction_calls_count = max(self._max_interaction_calls_count, calls_count)
+            logger.debug(f"Update {update_id} made {calls_count} Bot API calls: {dict(calls)}")
+            if self.on_interaction_finished:
+                self.on_interaction_finished(update_id, calls)
+
+    def count_call(self, method: str):
+        self._calls_by_method[method] += 1
+        calls = _interaction_calls.get()
+        if calls is not None:
+            calls[method] += 1
+
+class BotApiCallsCountingRequest(HTTPXRequest):
+    def __init__(self, calls_counter: BotApiCallsCounter, **kwargs):
+        super().__init__(**kwargs)
+        self._calls_counter = calls_counter
+
+    async def do_request(self, url: str, *args, **kwargs):
+        self._calls_counter.count_call(url.rsplit("/", 1)[-1])
+        return await super().do_request(url, *args, **kwargs)
@@ -0,0 +1,59 @@
+import asyncio
+import logging
+logger = logging.getLogger(__name__)
+
+import constants
+from telegram import Chat
+from telegram.error import TelegramError
+
+class ChatActionSender:
+    # Shows a chat action like "typing..." while an answer is prepared, instead of sending and deleting a wait message.
+    # Telegram hides the action after 5 seconds or when the bot sends a message, so it is repeated until stopped,
+    # but at most max_repeats times: every repeat is a Bot API call, and long operations would make dozens of them.
+    def __init__(
+        self,
+        chat: Chat,
+        action: str,
+        interval: float = constants.CHAT_ACTION_INTERVAL_SECONDS,
+        max_repeats: int = constants.DEFAULT_CHAT_ACTION_MAX_REPEATS
+    ):
+        self._chat = chat
+        self._action = action
+        self._interval = interval
+        self._max_repeats = max_repeats
+        self._repeater = None
+        self._sending = None
+
+    async def __aenter__(self):
+        # The first action is sent concurrently with the work instead of delaying it
+        self._repeater = asyncio.create_task(self._repeat())
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.stop()
+
+    async def stop(self):
+        if self._repeater:
+            self._repeater.cancel()
+            self._repeater = None
+        # An action which is still being sent could arrive after the answer and show "typing..." under it
+        if self._sending:
+            await self._sending
+            self._sending = None
+
+    async def _repeat(self):
+        for repeat in range(self._max_repeats + 1):
+            if repeat:
+                await asyncio.sleep(self._interval)
+            self._sending = asyncio.create_task(self._send())
+            if not await asyncio.shield(self._sending):
+                return
+
+    async def _send(self) -> bool:
+        try:
+            await self._chat.send_action(self._action)
+            return True
+        except TelegramError as error:
+            # The action is only a hint for the user, so the answer is not failed because of it
+            logger.warning(f"Chat action was not sent to chat {self._chat.id}: {error}")
+            return False
@@ -0,0 +1,46 @@
+import asyncio
+import logging
+logger = logging.getLogger(__name__)
+
+from typing import Any, Coroutine
+
+class OperationCancelledError(Exception):
+    pass
+
+class OperationTimeoutError(Exception):
+    pass
+
+class ChatOperations:
+    # Long operations of chats (OpenAI requests and delivery of their results) run as separate tasks with a deadline,
+    # so they can be aborted by the user. Cancelling a task closes its OpenAI request and frees its scheduler slot,
+    # and the update which started the operation finishes with OperationCancelledError.
+    def __init__(self):
+        self._operations: dict[int, asyncio.Task] = {}
+
+    @property
+    def stats(self) -> dict:
+        return {"operations_in_flight": len(self._operations)}
+
+    async def run(self, chat_id: int, coroutine: Coroutine[Any, Any, Any], timeout: float) -> Any:
+        operation = asyncio.create_task(coroutine)
+        self._operations[chat_id] = operation
+        try:
+            return await asyncio.wait_for(operation, timeout)
+        except asyncio.TimeoutError:
+            raise OperationTimeoutError(f"Operation of chat {chat_id} did not finish in {timeout} seconds") from None
+        except asyncio.CancelledError:
+            # The operation was removed by cancel(), otherwise the update processing itself is cancelled
+            if self._operations.get(chat_id) is not operation:
+                raise OperationCancelledError(f"Operation of chat {chat_id} was cancelled") from None
+            raise
+        finally:
+            if self._operations.get(chat_id) is operation:
+                del self._operations[chat_id]
+
+    def cancel(self, chat_id: int) -> bool:
+        operation = self._operations.pop(chat_id, None)
+        if operation is None:
+            return False
+        logger.info(f"Operation of chat {chat_id} is cancelled")
+        operation.cancel()
+        return True
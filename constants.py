@@ -3,9 +3,144 @@ from telegram import KeyboardButton
 # environment variables
 TELEGRAM_BOT_TOKEN_ENV = "TELEGRAM_BOT_TOKEN"
 API_KEYS_DB_ENCRYPTION_KEY_ENV = "API_KEYS_DB_ENCRYPTION_KEY"
+OPENAI_MAX_CONNECTIONS_ENV = "OPENAI_MAX_CONNECTIONS"
+OPENAI_KEEPALIVE_EXPIRY_ENV = "OPENAI_KEEPALIVE_EXPIRY"
+OPENAI_CONNECT_TIMEOUT_ENV = "OPENAI_CONNECT_TIMEOUT"
+OPENAI_REQUEST_TIMEOUT_ENV = "OPENAI_REQUEST_TIMEOUT"
+OPENAI_HTTP2_ENV = "OPENAI_HTTP2"
+MAX_CONCURRENT_UPDATES_ENV = "MAX_CONCURRENT_UPDATES"
+MAX_CHAT_QUEUE_SIZE_ENV = "MAX_CHAT_QUEUE_SIZE"
+STREAM_ASSISTANT_REPLIES_ENV = "STREAM_ASSISTANT_REPLIES"
+CHAT_HISTORY_MAX_TOKENS_ENV = "CHAT_HISTORY_MAX_TOKENS"
+CHAT_HISTORY_SUMMARIZATION_ENV = "CHAT_HISTORY_SUMMARIZATION"
+MAX_CONCURRENT_TRANSCRIPTION_SEGMENTS_ENV = "MAX_CONCURRENT_TRANSCRIPTION_SEGMENTS"
+COMPLETION_CACHE_ENABLED_ENV = "COMPLETION_CACHE_ENABLED"
+WEBHOOK_URL_ENV = "WEBHOOK_URL"
+WEBHOOK_PORT_ENV = "WEBHOOK_PORT"
+WEBHOOK_SECRET_TOKEN_ENV = "WEBHOOK_SECRET_TOKEN"
+WEBHOOK_WORKERS_ENV = "WEBHOOK_WORKERS"
+WEBHOOK_WORKERS_BASE_PORT_ENV = "WEBHOOK_WORKERS_BASE_PORT"
+METRICS_PORT_ENV = "METRICS_PORT"
+TELEGRAM_API_SERVER_ENV = "TELEGRAM_API_SERVER"
+OPENAI_API_BASE_URL_ENV = "OPENAI_API_BASE_URL"
+CHAT_ACTION_MAX_REPEATS_ENV = "CHAT_ACTION_MAX_REPEATS"
+
+# Webhook
+WEBHOOK_HOST = "0.0.0.0"
+DEFAULT_WEBHOOK_PORT = 8443
+DEFAULT_WEBHOOK_WORKERS = 1
+WEBHOOK_WORKERS_HOST = "127.0.0.1"
+DEFAULT_WEBHOOK_WORKERS_BASE_PORT = 9000
+WEBHOOK_SECRET_TOKEN_HEADER = "x-telegram-bot-api-secret-token"
+WEBHOOK_MAX_BODY_SIZE = 1024 * 1024
+WEBHOOK_FORWARD_TIMEOUT_SECONDS = 10
+
+# HTTP servers
+HTTP_READ_TIMEOUT_SECONDS = 10
+HTTP_IDLE_TIMEOUT_SECONDS = 60
+HTTP_MAX_HEADERS_COUNT = 100
+
+# Metrics and logs
+METRICS_HOST = "127.0.0.1"
+METRICS_LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+LOG_FILE_NAME = "telegram_bot.log"
+WORKER_LOG_FILE_NAME = "telegram_bot_{port}.log"
+LOG_FILE_MAX_SIZE = 50 * 1024 * 1024
+LOG_FILE_BACKUP_COUNT = 5
+
+# Updates processing
+DEFAULT_MAX_CONCURRENT_UPDATES = 256
+DEFAULT_MAX_CHAT_QUEUE_SIZE = 10
+TELEGRAM_CONNECTION_POOL_SIZE = 256
+DEFAULT_TELEGRAM_API_SERVER = "https://api.telegram.org"
+
+# Operations deadlines
+ANSWER_TIMEOUT_SECONDS = 120
+IMAGE_GENERATION_TIMEOUT_SECONDS = 180
+TRANSCRIPTION_TIMEOUT_SECONDS = 900
+
+# API keys database
+API_KEYS_CACHE_SIZE = 10000
+API_KEYS_CACHE_TTL_SECONDS = 600
+# Webhook workers only invalidate their own cache when a key is stored, so keys changed in other workers expire sooner
+WORKER_API_KEYS_CACHE_TTL_SECONDS = 10
+
+# Chat data persistence
+CHAT_DATA_DB_NAME = "chat_data.db"
+PERSISTENCE_UPDATE_INTERVAL_SECONDS = 10
+
+# Media files
+MAX_MEDIA_FILE_SIZE = 20 * 1024 * 1024
+MAX_IN_MEMORY_MEDIA_FILE_SIZE = 5 * 1024 * 1024
+TRANSCRIPTION_SEGMENT_DURATION_SECONDS = 120
+TRANSCRIPTION_SEGMENT_OVERLAP_SECONDS = 3
+TRANSCRIPTION_MAX_OVERLAP_WORDS = 30
+DEFAULT_MAX_CONCURRENT_TRANSCRIPTION_SEGMENTS = 8
+TRANSCRIPTION_CACHE_DB_NAME = "transcriptions.db"
+TRANSCRIPTION_CACHE_MAX_ENTRIES = 100000
+
+# Generated images
+IMAGE_CACHE_DB_NAME = "images.db"
+IMAGE_CACHE_MAX_ENTRIES = 100000
+
+# Telegram messages
+MAX_MESSAGE_LENGTH = 4096
+STREAM_EDIT_INTERVAL_SECONDS = 1.5
+CHAT_ACTION_INTERVAL_SECONDS = 4.5  # Telegram shows a chat action for 5 seconds
+DEFAULT_CHAT_ACTION_MAX_REPEATS = 3  # The action is shown for about 18 seconds, longer operations stay silent after that
+
+# OpenAI API
+OPENAI_API_BASE_URL = "https://api.openai.com/v1"
+OPENAI_REQUEST_TIMEOUT_SECONDS = 60
+DEFAULT_OPENAI_MAX_CONNECTIONS = 32
+DEFAULT_OPENAI_KEEPALIVE_EXPIRY_SECONDS = 120
+DEFAULT_OPENAI_CONNECT_TIMEOUT_SECONDS = 10
+TEXT_COMPLETION_MODEL = "text-davinci-003"
+TEXT_COMPLETION_MAX_TOKENS = 1024
+CHAT_COMPLETION_MODEL = "gpt-3.5-turbo"
+TRANSCRIPTION_MODEL = "whisper-1"
+ASSISTANT_ROLE_PROMPT = "You are {role}. Answer as this assistant would."
+IMAGE_SIZES = {
+    "Small": "256x256",
+    "Medium": "512x512",
+    "Large": "1024x1024"
+}
+
+# OpenAI requests scheduling, rate limits are requests per minute for every API key
+OPENAI_RATE_LIMITS = {
+    "/completions": 60,
+    "/chat/completions": 60,
+    "/images/generations": 5,
+    "/audio/transcriptions": 50
+}
+OPENAI_RATE_LIMIT_BUCKETS_COUNT = 100000
+OPENAI_MAX_QUEUE_TIME_SECONDS = 30
+# A request for 4 images may wait for tokens of the 5 rpm limit for up to 48 seconds
+OPENAI_ENDPOINT_MAX_QUEUE_TIMES_SECONDS = {
+    "/images/generations": 120
+}
+OPENAI_MAX_RETRIES = 3
+OPENAI_RETRY_BASE_DELAY_SECONDS = 1
+OPENAI_RETRY_MAX_DELAY_SECONDS = 20
+OPENAI_RETRY_STATUS_CODES = (429, 500, 502, 503)
+
+# Completion cache
+COMPLETION_CACHE_MAX_ENTRIES = 10000
+COMPLETION_CACHE_MAX_MEMORY_SIZE = 16 * 1024 * 1024
+COMPLETION_CACHE_TTL_SECONDS = 60 * 60
+
+# Chat history
+DEFAULT_CHAT_HISTORY_MAX_TOKENS = 3000
+CHARS_PER_TOKEN = 4
+MESSAGE_TOKENS_OVERHEAD = 4
+CHAT_SUMMARY_MAX_TOKENS = 256
+CHAT_SUMMARIZATION_PROMPT = "Summarize the following conversation between user and assistant briefly, keeping facts which may be needed to continue it."
+CHAT_SUMMARY_MESSAGE_PREFIX = "Summary of the earlier conversation: "
+CHAT_DATA_IDLE_TTL_SECONDS = 30 * 60
+CHAT_DATA_SWEEP_INTERVAL_SECONDS = 5 * 60
 
 # User and chat data field keys
-API_KEY_FIELD = "api_key"
 CHAT_STATE_FIELD = "chat_state"
 IMAGES_DESCRIPTION_KEY = "img_description"
 IMAGES_COUNT_KEY = "img_count"
@@ -20,22 +155,23 @@ API_KEY_REQUEST_MESSAGE = "Please provide me with your OpenAI API key via bot me
 API_KEY_SET_SUCCESSFULLY_MESSAGE = "API key set successfully! Now you can use bot functionality."
 # Conversation with Chat GPT
 ASSISTANT_ROLE_REQUEST_MESSAGE = "Please select role of your assistant from the given list or send me your option."
-ASSISTANT_IS_ANSWERING_MESSAGE = "Assistant is answering on your message. Please wait..."
 CHAT_STARTED_MESSAGE = "Chat with your assistant has been started. Feel free to ask something 😊"
 CHAT_ENDED_MESSAGE = "Chat with your assistant has been ended. It was a pleasure to communicate with you 😊"
 # Image Generation
 IMAGE_DESCRIPTION_REQUEST_MESSAGE = "Please provide description of image which you want to generate."
 IMAGE_COUNT_REQUEST_MESSAGE = "How much images do you want to generate?"
 IMAGE_SIZE_REQUEST_MESSAGE = "Please select images size."
-IMAGE_GENERATION_IN_PROGRESS_MESSAGE = "Images are generating at the moment. Please wait..."
 HERE_ARE_YOUR_IMAGES_MESSAGE = "Here are your images 😊"
+FEWER_IMAGES_MESSAGE = "Only {generated_count} of {count} images could be generated 😕"
 # Media file transcription
 TRANSCRIPT_MEDIA_HELP = "If you want transcript some media file or voice message than use `Transcript Media` menu button and provide bot with voice message, audio or video file."
 MEDIA_FILE_REQUEST_MESSAGE = "Please provide media file which you want to transcript. It can be voice message, audio or video file.\nSupported formats: ['m4a', 'mp3', 'webm', 'mp4', 'mpga', 'wav', 'mpeg']"
-TRANSCRIPTION_IN_PROGRESS_MESSAGE = "Transcription in progress. Please wait..."
+MEDIA_FILE_TOO_LARGE_MESSAGE = "Media file is too large. Please send a file which is smaller than 20 MB."
 # Errors
 SOMETHING_WENT_WRONG_MESSAGE = "Something went wrong."
 TRY_AGAIN_MESSAGE = "An error occurred. Please try again."
+OPENAI_IS_BUSY_MESSAGE = "Too many requests to OpenAI at the moment. Please try again in a minute."
+OPERATION_TIMED_OUT_MESSAGE = "OpenAI did not answer in time. Please try again later."
 # Help
 HELP_MESSAGE = '''
 1. In order to use bot functionality you need to provide bot with your OpenAI API Key. Read the following article if you need to know how and where to get it: <a href="https://www.awesomescreenshot.com/blog/knowledge/chat-gpt-api#How-do-I-get-an-API-key-for-Chat-GPT%3F">How to get OpenAI API Key?</a>
@@ -55,15 +191,15 @@ SET_API_KEY_BUTTON = [[KeyboardButton("Set API Key 🔑")]]
 CANCEL_BUTTON = [[KeyboardButton("Cancel ❌")]]
 END_CHAT_BUTTON = [[KeyboardButton("End Chat ❌")]]
 HELP_BUTTON = [[KeyboardButton("Help ℹ️")]]
-MAIN_BUTTONS = [
-    [KeyboardButton("Start Chat With Assistant 💬")],
-    [KeyboardButton("Generate Image 🖼️")],
-    [KeyboardButton("Transcript Media 🎧")]
-] + SET_API_KEY_BUTTON
+START_CHAT_BUTTON = [[KeyboardButton("Start Chat With Assistant 💬")]]
+GENERATE_IMAGE_BUTTON = [[KeyboardButton("Generate Image 🖼️")]]
+TRANSCRIPT_MEDIA_BUTTON = [[KeyboardButton("Transcript Media 🎧")]]
+MAIN_BUTTONS = START_CHAT_BUTTON + GENERATE_IMAGE_BUTTON + TRANSCRIPT_MEDIA_BUTTON + SET_API_KEY_BUTTON
 IMAGE_COUNT_BUTTONS = [
     [KeyboardButton("1️⃣"), KeyboardButton("2️⃣")],
     [KeyboardButton("3️⃣"), KeyboardButton("4️⃣")]
 ]
+IMAGE_COUNTS = {button.text: count for count, button in enumerate(IMAGE_COUNT_BUTTONS[0] + IMAGE_COUNT_BUTTONS[1], 1)}
 IMAGE_SIZE_BUTTONS = [
     [KeyboardButton("Small")],
     [KeyboardButton("Medium")],
@@ -0,0 +1,44 @@
+import asyncio
+from dataclasses import dataclass, field
+
+import constants
+
+class HttpRequestError(Exception):
+    # The request can't be accepted, status is the HTTP status of the response to send before closing the connection
+    def __init__(self, status: str):
+        super().__init__(status)
+        self.status = status
+
+@dataclass
+class HttpRequest:
+    method: bytes
+    path: bytes
+    headers: dict = field(default_factory=dict)
+    body: bytes = b""
+
+    @property
+    def keep_alive(self) -> bool:
+        return self.headers.get("connection", "").lower() != "close"
+
+async def read_http_request(reader: asyncio.StreamReader, max_body_size: int) -> HttpRequest | None:
+    # Reads one HTTP/1.1 request for the minimal servers of the bot, None means that the client closed the connection.
+    # Idle and slow clients get asyncio.TimeoutError, so they can't hold connections forever.
+    request_line = await asyncio.wait_for(reader.readline(), constants.HTTP_IDLE_TIMEOUT_SECONDS)
+    if not request_line:
+        return None
+    method, path = (request_line.split(b" ") + [b"", b""])[:2]
+    headers = {}
+    while (line := await _read(reader.readline())) not in (b"\r\n", b"\n", b""):
+        if len(headers) >= constants.HTTP_MAX_HEADERS_COUNT:
+            raise HttpRequestError("431 Request Header Fields Too Large")
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    content_length = int(headers.get("content-length", 0))
+    if content_length > max_body_size:
+        raise HttpRequestError("413 Payload Too Large")
+    body = await _read(reader.readexactly(content_length))
+    return HttpRequest(method, path, headers, body)
+
+async def _read(read) -> bytes:
+    return await asyncio.wait_for(read, constants.HTTP_READ_TIMEOUT_SECONDS)
@@ -0,0 +1,22 @@
+import constants
+from telegram import ReplyKeyboardMarkup
+
+class PrebuiltReplyKeyboardMarkup(ReplyKeyboardMarkup):
+    # Bot menus never change, so every menu is built and serialized once instead of on every reply
+    __slots__ = ("_serialized_markup",)
+
+    def __init__(self, keyboard: list):
+        super().__init__(keyboard + constants.HELP_BUTTON, resize_keyboard=True)
+        with self._unfrozen():
+            self._serialized_markup = super().to_dict()
+
+    def to_dict(self, recursive: bool = True) -> dict:
+        return dict(self._serialized_markup)
+
+MAIN_MENU = PrebuiltReplyKeyboardMarkup(constants.MAIN_BUTTONS)
+SET_API_KEY_MENU = PrebuiltReplyKeyboardMarkup(constants.SET_API_KEY_BUTTON)
+CANCEL_MENU = PrebuiltReplyKeyboardMarkup(constants.CANCEL_BUTTON)
+END_CHAT_MENU = PrebuiltReplyKeyboardMarkup(constants.END_CHAT_BUTTON)
+ASSISTANT_ROLES_MENU = PrebuiltReplyKeyboardMarkup(constants.ASSISTANT_ROLES_BUTTONS + constants.CANCEL_BUTTON)
+IMAGE_COUNT_MENU = PrebuiltReplyKeyboardMarkup(constants.IMAGE_COUNT_BUTTONS + constants.CANCEL_BUTTON)
+IMAGE_SIZE_MENU = PrebuiltReplyKeyboardMarkup(constants.IMAGE_SIZE_BUTTONS + constants.CANCEL_BUTTON)
@@ -0,0 +1,57 @@
+import atexit
+import copy
+import json
+import logging
+import queue
+
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+import constants
+
+class JsonFormatter(logging.Formatter):
+    # Writes every record as one JSON object per line, so logs can be parsed without relying on the message format
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "process": record.process,
+            "message": record.getMessage()
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+class _QueueHandler(QueueHandler):
+    # The base handler merges the traceback into the message, which would hide it from the "exception" field
+    # of the JSON log. Here the message is only merged with its arguments and the traceback is kept as text,
+    # the traceback object itself is not passed to the listener thread.
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = record.exc_text or logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+def configure_logging(log_file_name: str = constants.LOG_FILE_NAME, level: int = logging.INFO) -> QueueListener:
+    # The event loop thread only puts records to a queue, they are formatted and written to the console
+    # and to the rotated log file by the listener thread
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(logging.Formatter(constants.LOG_FORMAT))
+    file_handler = RotatingFileHandler(log_file_name, maxBytes=constants.LOG_FILE_MAX_SIZE, backupCount=constants.LOG_FILE_BACKUP_COUNT, encoding="utf-8")
+    file_handler.setFormatter(JsonFormatter())
+
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, console_handler, file_handler)
+    # The queue handler only merges the message with its arguments, the final formatting is done by the listener handlers
+    queue_handler = _QueueHandler(log_queue)
+    logging.basicConfig(level=level, handlers=[queue_handler], force=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
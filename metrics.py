@@ -0,0 +1,84 @@
+import bisect
+import time
+
+from contextlib import contextmanager
+from typing import Callable
+
+import constants
+
+class MetricsRegistry:
+    # Collects metrics in the Prometheus text exposition format
+    def __init__(self):
+        self._collectors: list[Callable[[], list[str]]] = []
+
+    def register(self, collect: Callable[[], list[str]]):
+        self._collectors.append(collect)
+
+    def register_stats(self, prefix: str, get_stats: Callable[[], dict]):
+        # Exposes numbers of a stats dict as gauges named prefix_key, nested dicts of numbers become labeled series
+        def collect() -> list[str]:
+            lines = []
+            for key, value in get_stats().items():
+                name = f"{prefix}_{key}"
+                if isinstance(value, dict):
+                    lines.append(f"# TYPE {name} gauge")
+                    lines += [f'{name}{{key="{_escape(label)}"}} {number}' for label, number in value.items()]
+                elif isinstance(value, (int, float)):
+                    lines += [f"# TYPE {name} gauge", f"{name} {value}"]
+            return lines
+        self.register(collect)
+
+    def render(self) -> str:
+        return "".join(f"{line}\n" for collect in self._collectors for line in collect())
+
+REGISTRY = MetricsRegistry()
+
+class Histogram:
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        label_names: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = constants.METRICS_LATENCY_BUCKETS,
+        registry: MetricsRegistry = REGISTRY
+    ):
+        self._name = name
+        self._documentation = documentation
+        self._label_names = label_names
+        self._buckets = buckets
+        # Labels values -> [count of every bucket and +Inf, sum of values]
+        self._series: dict[tuple[str, ...], list] = {}
+        registry.register(self.collect)
+
+    def observe(self, value: float, *label_values: str):
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = [[0] * (len(self._buckets) + 1), 0.0]
+        series[0][bisect.bisect_left(self._buckets, value)] += 1
+        series[1] += value
+
+    @contextmanager
+    def time(self, *label_values: str):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start_time, *label_values)
+
+    def collect(self) -> list[str]:
+        lines = [f"# HELP {self._name} {self._documentation}", f"# TYPE {self._name} histogram"]
+        for label_values, (bucket_counts, values_sum) in self._series.items():
+            labels = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(self._label_names, label_values))
+            bucket_labels_prefix = f"{labels}," if labels else ""
+            count = 0
+            for bound, bucket_count in zip(self._buckets + (float("inf"),), bucket_counts):
+                count += bucket_count
+                le = "+Inf" if bound == float("inf") else bound
+                lines.append(f'{self._name}_bucket{{{bucket_labels_prefix}le="{le}"}} {count}')
+            series_labels = f"{{{labels}}}" if labels else ""
+            lines.append(f"{self._name}_sum{series_labels} {values_sum}")
+            lines.append(f"{self._name}_count{series_labels} {count}")
+        return lines
+
+def _escape(label_value) -> str:
+    return str(label_value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
@@ -0,0 +1,49 @@
+import asyncio
+import logging
+logger = logging.getLogger(__name__)
+
+from http_request import HttpRequestError, read_http_request
+from metrics import MetricsRegistry, REGISTRY
+
+class MetricsServer:
+    # Minimal HTTP/1.1 server which serves GET /metrics for Prometheus, it is meant to listen on a local interface only.
+    # Slow or idle clients are disconnected by the same timeouts as in WebhookServer.
+    def __init__(self, host: str, port: int, registry: MetricsRegistry = REGISTRY):
+        self._host = host
+        self._port = port
+        self._registry = registry
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_connection, self._host, self._port)
+        logger.info(f"Metrics server is listening on {self._host}:{self._port}")
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request = await read_http_request(reader, 0)
+            if not request:
+                return
+            if request.method != b"GET":
+                self._respond(writer, "405 Method Not Allowed")
+            elif request.path.split(b"?", 1)[0] != b"/metrics":
+                self._respond(writer, "404 Not Found")
+            else:
+                self._respond(writer, "200 OK", self._registry.render().encode())
+            await writer.drain()
+        except HttpRequestError as error:
+            # Closing the writer sends the buffered response
+            self._respond(writer, error.status)
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    def _respond(writer: asyncio.StreamWriter, status: str, body: bytes = b""):
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+        )
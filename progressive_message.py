@@ -0,0 +1,58 @@
+import asyncio
+import time
+
+import constants
+from telegram import Message, ReplyKeyboardMarkup
+from telegram.error import RetryAfter
+
+class ProgressiveMessage:
+    # Shows a growing text in one reply message by editing it in place. The reply is sent with the first non-empty text,
+    # intermediate edits are throttled in order to stay within Telegram edit rate limits, the final text is always delivered.
+    def __init__(self, reply_to: Message, edit_interval: float = constants.STREAM_EDIT_INTERVAL_SECONDS):
+        self._reply_to = reply_to
+        self._message = None
+        self._edit_interval = edit_interval
+        self._shown_text = ""
+        self._next_edit_time = 0.0
+
+    async def update(self, text: str):
+        if time.monotonic() < self._next_edit_time:
+            return
+        try:
+            await self._show(text[:constants.MAX_MESSAGE_LENGTH])
+        except RetryAfter as error:
+            self._next_edit_time = time.monotonic() + self._retry_after_seconds(error)
+
+    async def finish(self, text: str, reply_markup: ReplyKeyboardMarkup | None = None) -> bool:
+        # A reply keyboard can't be added by an edit, so reply_markup is attached only if the last part of the text
+        # is sent as a new message. Returns whether it was attached.
+        parts = [text[i:i + constants.MAX_MESSAGE_LENGTH] for i in range(0, len(text), constants.MAX_MESSAGE_LENGTH)]
+        if not parts:
+            return False
+        first_part_markup = reply_markup if len(parts) == 1 else None
+        try:
+            sent = await self._show(parts[0], first_part_markup)
+        except RetryAfter as error:
+            await asyncio.sleep(self._retry_after_seconds(error))
+            sent = await self._show(parts[0], first_part_markup)
+        for i, part in enumerate(parts[1:], 2):
+            await self._reply_to.reply_text(part, reply_markup=reply_markup if i == len(parts) else None)
+        return reply_markup is not None and (sent or len(parts) > 1)
+
+    async def _show(self, text: str, reply_markup: ReplyKeyboardMarkup | None = None) -> bool:
+        # Returns whether a new message was sent
+        if not text.strip() or text == self._shown_text:
+            return False
+        sent = self._message is None
+        if sent:
+            self._message = await self._reply_to.reply_text(text, reply_markup=reply_markup)
+        else:
+            await self._message.edit_text(text)
+        self._shown_text = text
+        self._next_edit_time = time.monotonic() + self._edit_interval
+        return sent
+
+    @staticmethod
+    def _retry_after_seconds(error: RetryAfter) -> float:
+        retry_after = error.retry_after
+        return retry_after if isinstance(retry_after, (int, float)) else retry_after.total_seconds()
@@ -0,0 +1,56 @@
+import asyncio
+import unittest
+
+from telegram.error import NetworkError
+
+from chat_action import ChatActionSender
+
+class FakeChat:
+    id = 1
+
+    def __init__(self, send_duration: float = 0, error: Exception | None = None):
+        self.actions_count = 0
+        self.sent_actions_count = 0
+        self._send_duration = send_duration
+        self._error = error
+
+    async def send_action(self, action: str):
+        self.actions_count += 1
+        await asyncio.sleep(self._send_duration)
+        if self._error:
+            raise self._error
+        self.sent_actions_count += 1
+
+class ChatActionSenderTest(unittest.IsolatedAsyncioTestCase):
+    async def test_action_is_repeated_until_stopped(self):
+        chat = FakeChat()
+        async with ChatActionSender(chat, "typing", interval=0.01, max_repeats=100):
+            await asyncio.sleep(0.1)
+        actions_count = chat.actions_count
+        self.assertGreater(actions_count, 3)
+        await asyncio.sleep(0.05)
+        self.assertEqual(chat.actions_count, actions_count)
+
+    async def test_repeats_are_limited(self):
+        chat = FakeChat()
+        async with ChatActionSender(chat, "typing", interval=0.01, max_repeats=2):
+            await asyncio.sleep(0.1)
+        self.assertEqual(chat.actions_count, 3)
+
+    async def test_work_is_not_delayed_by_first_action(self):
+        chat = FakeChat(send_duration=0.05)
+        async with ChatActionSender(chat, "typing"):
+            await asyncio.sleep(0)
+            self.assertEqual(chat.sent_actions_count, 0)
+        # The answer is sent only after the action, so "typing..." never appears under it
+        self.assertEqual(chat.sent_actions_count, 1)
+
+    async def test_failed_action_stops_repeating(self):
+        chat = FakeChat(error=NetworkError("unavailable"))
+        with self.assertLogs("chat_action", "WARNING"):
+            async with ChatActionSender(chat, "typing", interval=0.01):
+                await asyncio.sleep(0.05)
+        self.assertEqual(chat.actions_count, 1)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+import asyncio
+import os
+import tempfile
+import unittest
+
+from telegram.ext import ApplicationBuilder
+
+from DBService.chat_data_persistence import ChatDataPersistence
+
+class ChatDataPersistenceTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.db_name = os.path.join(self.directory.name, "chat_data.db")
+        self.persistence, self.application = self.create_application()
+
+    def create_application(self):
+        persistence = ChatDataPersistence(self.db_name)
+        return persistence, ApplicationBuilder().token("123:TEST").persistence(persistence).build()
+
+    async def receive_update(self, chat_id: int) -> dict:
+        # The application refreshes chat_data of the chat before its update is handled
+        chat_data = self.application.chat_data[chat_id]
+        await self.persistence.refresh_chat_data(chat_id, chat_data)
+        return chat_data
+
+    async def update_persistence(self, application=None):
+        await (application or self.application).update_persistence()
+        await asyncio.sleep(0)
+        if self.persistence._write_task:
+            await self.persistence._write_task
+
+    async def stored_chat_data(self, chat_id: int) -> dict:
+        persistence, application = self.create_application()
+        chat_data = application.chat_data[chat_id]
+        await persistence.refresh_chat_data(chat_id, chat_data)
+        persistence.close()
+        return dict(chat_data)
+
+    async def asyncTearDown(self):
+        await self.persistence.flush()
+
+    async def test_idle_chat_is_evicted_and_loaded_back(self):
+        chat_data = await self.receive_update(1)
+        chat_data["state"] = "value"
+        self.application.mark_data_for_update_persistence(chat_ids=1)
+        await self.receive_update(2)
+        await asyncio.sleep(0.02)
+        await self.receive_update(2)
+
+        self.assertEqual(self.persistence.idle_chat_ids(0.01), [1])
+        self.persistence.evict_chat_data(1)
+        self.application.drop_chat_data(1)
+        await self.update_persistence()
+
+        self.assertNotIn(1, self.application.chat_data)
+        self.assertEqual(self.persistence.idle_chat_ids(0), [2])
+        self.assertEqual(self.persistence._evicted_chat_ids, set())
+        self.assertEqual(await self.stored_chat_data(1), {"state": "value"})
+        self.assertEqual(await self.receive_update(1), {"state": "value"})
+
+    async def test_chat_loaded_again_before_drop_keeps_its_changes(self):
+        (await self.receive_update(1))["state"] = "old"
+        self.persistence.evict_chat_data(1)
+        self.application.drop_chat_data(1)
+
+        chat_data = await self.receive_update(1)
+        self.assertEqual(chat_data, {"state": "old"})
+        chat_data["state"] = "new"
+        self.application.mark_data_for_update_persistence(chat_ids=1)
+        await self.update_persistence()
+
+        self.assertEqual(await self.stored_chat_data(1), {"state": "new"})
+
+    async def test_dropped_chat_is_deleted(self):
+        (await self.receive_update(1))["state"] = "value"
+        self.application.mark_data_for_update_persistence(chat_ids=1)
+        await self.update_persistence()
+        self.application.drop_chat_data(1)
+        await self.update_persistence()
+
+        self.assertEqual(await self.stored_chat_data(1), {})
+        self.assertEqual(self.persistence.idle_chat_ids(0), [])
+
+if __name__ == "__main__":
+    unittest.main()
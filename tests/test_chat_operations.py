@@ -0,0 +1,103 @@
+import asyncio
+import datetime
+import unittest
+
+from telegram import Chat, Message, Update
+
+import constants
+from bot import ChatGPTBot
+from chat_operations import ChatOperations, OperationCancelledError, OperationTimeoutError
+
+class ChatOperationsTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.operations = ChatOperations()
+        self.operation_cancelled = False
+
+    async def operation(self, duration: float = 1, result: str = "result") -> str:
+        try:
+            await asyncio.sleep(duration)
+        except asyncio.CancelledError:
+            self.operation_cancelled = True
+            raise
+        return result
+
+    async def test_result_is_returned(self):
+        self.assertEqual(await self.operations.run(1, self.operation(0), 1), "result")
+        self.assertEqual(self.operations.stats, {"operations_in_flight": 0})
+
+    async def test_cancel_while_running(self):
+        run = asyncio.create_task(self.operations.run(1, self.operation(), 1))
+        await asyncio.sleep(0.01)
+        self.assertEqual(self.operations.stats, {"operations_in_flight": 1})
+        self.assertTrue(self.operations.cancel(1))
+        with self.assertRaises(OperationCancelledError):
+            await run
+        self.assertTrue(self.operation_cancelled)
+        self.assertEqual(self.operations.stats, {"operations_in_flight": 0})
+
+    def test_cancel_without_operation(self):
+        self.assertFalse(self.operations.cancel(1))
+
+    async def test_timeout(self):
+        with self.assertRaises(OperationTimeoutError):
+            await self.operations.run(1, self.operation(), 0.01)
+        self.assertTrue(self.operation_cancelled)
+        self.assertEqual(self.operations.stats, {"operations_in_flight": 0})
+
+    async def test_cancelling_outer_task_propagates_cancelled_error(self):
+        run = asyncio.create_task(self.operations.run(1, self.operation(), 1))
+        await asyncio.sleep(0.01)
+        run.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await run
+        self.assertTrue(self.operation_cancelled)
+        self.assertEqual(self.operations.stats, {"operations_in_flight": 0})
+
+    async def test_run_after_cancel(self):
+        first_run = asyncio.create_task(self.operations.run(1, self.operation(), 1))
+        await asyncio.sleep(0.01)
+        self.operations.cancel(1)
+        # The next operation starts before the cancelled one has finished, which must not unregister it
+        second_run = asyncio.create_task(self.operations.run(1, self.operation(0.05, "second"), 1))
+        await asyncio.sleep(0)
+        with self.assertRaises(OperationCancelledError):
+            await first_run
+        self.assertEqual(self.operations.stats, {"operations_in_flight": 1})
+        self.assertEqual(await second_run, "second")
+        self.assertEqual(self.operations.stats, {"operations_in_flight": 0})
+
+    async def test_operations_of_other_chats_are_not_cancelled(self):
+        first_run = asyncio.create_task(self.operations.run(1, self.operation(0.01, "first"), 1))
+        second_run = asyncio.create_task(self.operations.run(2, self.operation(), 1))
+        await asyncio.sleep(0)
+        self.operations.cancel(2)
+        self.assertEqual(await first_run, "first")
+        with self.assertRaises(OperationCancelledError):
+            await second_run
+
+class CancelChatOperationIfRequestedTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.bot = ChatGPTBot.__new__(ChatGPTBot)
+        self.bot._chat_operations = ChatOperations()
+
+    @staticmethod
+    def make_update(text: str) -> Update:
+        message = Message(1, datetime.datetime.now(datetime.timezone.utc), Chat(1, Chat.PRIVATE), text=text)
+        return Update(1, message=message)
+
+    async def run_operation_and_receive(self, text: str):
+        run = asyncio.create_task(self.bot._chat_operations.run(1, asyncio.sleep(0.05), 1))
+        await asyncio.sleep(0)
+        self.bot._cancel_chat_operation_if_requested(self.make_update(text))
+        await run
+
+    async def test_cancel_and_end_chat_buttons_cancel_operation(self):
+        for text in (constants.CANCEL_BUTTON[0][0].text, constants.END_CHAT_BUTTON[0][0].text):
+            with self.subTest(text=text), self.assertRaises(OperationCancelledError):
+                await self.run_operation_and_receive(text)
+
+    async def test_other_messages_dont_cancel_operation(self):
+        await self.run_operation_and_receive("Hello")
+
+if __name__ == "__main__":
+    unittest.main()
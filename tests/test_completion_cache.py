@@ -0,0 +1,60 @@
+import asyncio
+import unittest
+
+from OpenAIService.completion_cache import CompletionCache
+
+class CompletionCacheTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.cache = CompletionCache()
+        self.requests_count = 0
+
+    async def request(self, answer: str = "answer", error: Exception | None = None, delay: float = 0) -> str:
+        self.requests_count += 1
+        await asyncio.sleep(delay)
+        if error:
+            raise error
+        return answer
+
+    async def test_answer_is_cached(self):
+        self.assertEqual(await self.cache.get_or_request("model", "Question", self.request), "answer")
+        self.assertEqual(await self.cache.get_or_request("model", "  question ", self.request), "answer")
+        self.assertEqual(self.requests_count, 1)
+        self.assertEqual(self.cache.stats["hits"], 1)
+
+    async def test_answers_of_different_models_are_not_shared(self):
+        await self.cache.get_or_request("first", "question", self.request)
+        await self.cache.get_or_request("second", "question", self.request)
+        self.assertEqual(self.requests_count, 2)
+
+    async def test_identical_requests_are_coalesced(self):
+        answers = await asyncio.gather(*(self.cache.get_or_request("model", "question", lambda: self.request(delay=0.01)) for _ in range(3)))
+        self.assertEqual(answers, ["answer"] * 3)
+        self.assertEqual(self.requests_count, 1)
+        self.assertEqual(self.cache.stats["coalesced"], 2)
+
+    async def test_error_is_not_shared_with_waiters(self):
+        failed_request = self.cache.get_or_request("model", "question", lambda: self.request(error=PermissionError("invalid key"), delay=0.01))
+        waiting_request = self.cache.get_or_request("model", "question", lambda: self.request(delay=0.01))
+        results = await asyncio.gather(failed_request, waiting_request, return_exceptions=True)
+        self.assertIsInstance(results[0], PermissionError)
+        self.assertEqual(results[1], "answer")
+        self.assertEqual(self.requests_count, 2)
+
+    async def test_cancelled_request_is_repeated_by_waiter(self):
+        cancelled_request = asyncio.create_task(self.cache.get_or_request("model", "question", lambda: self.request(delay=1)))
+        await asyncio.sleep(0)
+        waiting_request = asyncio.create_task(self.cache.get_or_request("model", "question", lambda: self.request(delay=0.01)))
+        await asyncio.sleep(0)
+        cancelled_request.cancel()
+        self.assertEqual(await waiting_request, "answer")
+        with self.assertRaises(asyncio.CancelledError):
+            await cancelled_request
+
+    async def test_errors_are_not_cached(self):
+        with self.assertRaises(PermissionError):
+            await self.cache.get_or_request("model", "question", lambda: self.request(error=PermissionError("invalid key")))
+        self.assertEqual(await self.cache.get_or_request("model", "question", self.request), "answer")
+        self.assertEqual(self.requests_count, 2)
+
+if __name__ == "__main__":
+    unittest.main()
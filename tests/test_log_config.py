@@ -0,0 +1,51 @@
+import atexit
+import json
+import logging
+import os
+import tempfile
+import unittest
+
+from log_config import configure_logging
+
+class ConfigureLoggingTest(unittest.TestCase):
+    def setUp(self):
+        root_logger = logging.getLogger()
+        handlers, level = root_logger.handlers[:], root_logger.level
+        self.addCleanup(logging.basicConfig, level=level, handlers=handlers, force=True)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.log_file_name = os.path.join(directory.name, "test.log")
+
+    def configure_logging(self):
+        listener = configure_logging(self.log_file_name)
+        # The listener is stopped by the test to flush the records, not at exit
+        atexit.unregister(listener.stop)
+        return listener
+
+    def log_entries(self) -> list[dict]:
+        with open(self.log_file_name, encoding="utf-8") as log_file:
+            return [json.loads(line) for line in log_file]
+
+    def test_records_are_written_as_json(self):
+        listener = self.configure_logging()
+        logging.getLogger("test").warning("Update %s failed", 1)
+        listener.stop()
+
+        entry, = self.log_entries()
+        self.assertEqual((entry["level"], entry["logger"], entry["message"]), ("WARNING", "test", "Update 1 failed"))
+        self.assertNotIn("exception", entry)
+
+    def test_exception_is_written_to_its_own_field(self):
+        listener = self.configure_logging()
+        try:
+            raise ValueError("broken")
+        except ValueError:
+            logging.getLogger("test").exception("Update %s failed", 1)
+        listener.stop()
+
+        entry, = self.log_entries()
+        self.assertEqual(entry["message"], "Update 1 failed")
+        self.assertIn("ValueError: broken", entry["exception"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,34 @@
+import unittest
+
+import constants
+from OpenAIService.media_transcriber import MediaTranscriber
+
+class StitchTest(unittest.TestCase):
+    def test_overlapping_words_are_not_repeated(self):
+        transcriptions = ["The quick brown fox jumps", "fox jumps over the lazy", "the lazy dog."]
+        self.assertEqual(MediaTranscriber._stitch(transcriptions), "The quick brown fox jumps over the lazy dog.")
+
+    def test_segments_without_overlap_are_joined(self):
+        self.assertEqual(MediaTranscriber._stitch(["Hello there.", "General Kenobi."]), "Hello there. General Kenobi.")
+
+    def test_empty_segments_are_skipped(self):
+        self.assertEqual(MediaTranscriber._stitch(["", "Hello", "", "world"]), "Hello world")
+
+class OverlapLengthTest(unittest.TestCase):
+    def test_punctuation_and_case_are_ignored(self):
+        self.assertEqual(MediaTranscriber._overlap_length(["over", "the", "Lazy,"], ["lazy", "dog"]), 1)
+        self.assertEqual(MediaTranscriber._overlap_length(["jumps", "over", "the."], ["Over", "the", "dog"]), 2)
+
+    def test_longest_overlap_is_found(self):
+        self.assertEqual(MediaTranscriber._overlap_length(["a", "b", "a", "b"], ["a", "b", "a", "b", "c"]), 4)
+
+    def test_no_overlap(self):
+        self.assertEqual(MediaTranscriber._overlap_length(["first"], ["second"]), 0)
+        self.assertEqual(MediaTranscriber._overlap_length([], ["word"]), 0)
+
+    def test_overlap_is_limited(self):
+        words = ["word"] * (constants.TRANSCRIPTION_MAX_OVERLAP_WORDS + 10)
+        self.assertEqual(MediaTranscriber._overlap_length(words, words), constants.TRANSCRIPTION_MAX_OVERLAP_WORDS)
+
+if __name__ == "__main__":
+    unittest.main()
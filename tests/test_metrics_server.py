@@ -0,0 +1,46 @@
+import asyncio
+import unittest
+from unittest.mock import patch
+
+from metrics import MetricsRegistry
+from metrics_server import MetricsServer
+
+class MetricsServerTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        registry = MetricsRegistry()
+        registry.register(lambda: ["test_metric 1"])
+        self.server = MetricsServer("127.0.0.1", 0, registry)
+        await self.server.start()
+        self.port = self.server._server.sockets[0].getsockname()[1]
+
+    async def asyncTearDown(self):
+        await self.server.stop()
+
+    async def request(self, data: bytes) -> bytes:
+        reader, writer = await asyncio.open_connection("127.0.0.1", self.port)
+        writer.write(data)
+        response = await asyncio.wait_for(reader.read(), 1)
+        writer.close()
+        return response
+
+    async def test_metrics_are_served(self):
+        response = await self.request(b"GET /metrics HTTP/1.1\r\nHost: localhost\r\n\r\n")
+        self.assertTrue(response.startswith(b"HTTP/1.1 200 OK"))
+        self.assertIn(b"test_metric 1", response)
+
+    async def test_unknown_path_is_not_found(self):
+        response = await self.request(b"GET /other HTTP/1.1\r\n\r\n")
+        self.assertTrue(response.startswith(b"HTTP/1.1 404 Not Found"))
+
+    async def test_idle_client_is_disconnected(self):
+        with patch("constants.HTTP_IDLE_TIMEOUT_SECONDS", 0.05):
+            self.assertEqual(await self.request(b""), b"")
+
+    async def test_stalled_headers_are_disconnected(self):
+        with patch("constants.HTTP_READ_TIMEOUT_SECONDS", 0.05):
+            self.assertEqual(await self.request(b"GET /metrics HTTP/1.1\r\nHost: localhost\r\n"), b"")
+
+    async def test_too_many_headers_are_rejected(self):
+        with patch("constants.HTTP_MAX_HEADERS_COUNT", 2):
+            response = await self.request(b"GET /metrics HTTP/1.1\r\nA: 1\r\nB: 2\r\nC: 3\r\n\r\n")
+        self.assertTrue(response.startswith(b"HTTP/1.1 431 Request Header Fields Too Large"))
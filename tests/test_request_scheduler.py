@@ -0,0 +1,129 @@
+import asyncio
+import time
+import unittest
+from unittest.mock import patch
+
+import httpx
+
+import constants
+from OpenAIService.request_scheduler import RequestExpiredError, RequestScheduler, TokenBucket
+
+class TokenBucketTest(unittest.TestCase):
+    def test_full_bucket_is_available(self):
+        bucket = TokenBucket(60)
+        self.assertEqual(bucket.time_until_available(time.monotonic()), 0)
+
+    def test_empty_bucket_refills_with_rate(self):
+        bucket = TokenBucket(60)
+        now = time.monotonic()
+        for _ in range(60):
+            bucket.consume(now)
+        self.assertAlmostEqual(bucket.time_until_available(now), 1.0)
+        self.assertAlmostEqual(bucket.time_until_available(now + 0.25), 0.75)
+        self.assertEqual(bucket.time_until_available(now + 1), 0)
+
+    def test_refill_is_capped_by_capacity(self):
+        bucket = TokenBucket(2)
+        now = time.monotonic() + 3600
+        for _ in range(2):
+            bucket.consume(now)
+        self.assertGreater(bucket.time_until_available(now), 0)
+
+    def test_pause_delays_available_bucket(self):
+        bucket = TokenBucket(60)
+        bucket.pause(5)
+        self.assertAlmostEqual(bucket.time_until_available(time.monotonic()), 5, delta=0.1)
+
+class RequestSchedulerTest(unittest.IsolatedAsyncioTestCase):
+    async def test_requests_of_different_keys_are_served_in_turn(self):
+        scheduler = RequestScheduler(1, rate_limits={"/endpoint": 600})
+        served = []
+
+        async def request(api_key: str):
+            async with scheduler.slot(api_key, "/endpoint"):
+                served.append(api_key)
+                await asyncio.sleep(0)
+
+        async with scheduler.slot("first", "/endpoint"):
+            tasks = [asyncio.create_task(request(api_key)) for api_key in ("first", "first", "first", "second", "second")]
+            await asyncio.sleep(0)
+        await asyncio.gather(*tasks)
+        self.assertEqual(served, ["first", "second", "first", "second", "first"])
+
+    async def test_request_expires_in_queue(self):
+        scheduler = RequestScheduler(1, max_queue_time=0.05, rate_limits={"/endpoint": 600})
+        async with scheduler.slot("key", "/endpoint"):
+            with self.assertRaises(RequestExpiredError):
+                async with scheduler.slot("key", "/endpoint"):
+                    pass
+        self.assertEqual(scheduler.stats, {"requests_in_flight": 0, "queued_requests": 0})
+
+    async def test_request_over_rate_limit_expires_while_other_keys_are_served(self):
+        scheduler = RequestScheduler(2, max_queue_time=0.05, rate_limits={"/endpoint": 1})
+        async with scheduler.slot("first", "/endpoint"):
+            pass
+        with self.assertRaises(RequestExpiredError):
+            async with scheduler.slot("first", "/endpoint"):
+                pass
+        async with scheduler.slot("second", "/endpoint"):
+            pass
+
+    async def test_endpoint_queue_time_overrides_default(self):
+        scheduler = RequestScheduler(1, max_queue_time=0.01, rate_limits={"/slow": 600}, endpoint_max_queue_times={"/slow": 1})
+
+        async def hold_slot():
+            async with scheduler.slot("key", "/slow"):
+                await asyncio.sleep(0.1)
+
+        holder = asyncio.create_task(hold_slot())
+        await asyncio.sleep(0)
+        async with scheduler.slot("key", "/slow"):
+            pass
+        await holder
+
+    @patch("OpenAIService.request_scheduler.random.uniform", return_value=0)
+    async def test_retry_after_pauses_requests_of_the_key(self, _):
+        scheduler = RequestScheduler(2, rate_limits={"/endpoint": 600})
+        response = httpx.Response(429, headers={"retry-after": "0.2"})
+        self.assertEqual(scheduler.retry_delay("first", "/endpoint", 0, response), 0.2)
+
+        started_at = time.monotonic()
+        async with scheduler.slot("second", "/endpoint"):
+            self.assertLess(time.monotonic() - started_at, 0.1)
+        async with scheduler.slot("first", "/endpoint"):
+            self.assertGreaterEqual(time.monotonic() - started_at, 0.19)
+
+    def test_retry_delay_is_none_for_final_responses(self):
+        scheduler = RequestScheduler(1)
+        self.assertIsNone(scheduler.retry_delay("key", "/completions", 0, httpx.Response(400)))
+        self.assertIsNone(scheduler.retry_delay("key", "/completions", constants.OPENAI_MAX_RETRIES, httpx.Response(429)))
+
+    async def test_cancelled_waiter_does_not_take_slot(self):
+        scheduler = RequestScheduler(1, rate_limits={"/endpoint": 600})
+        async with scheduler.slot("key", "/endpoint"):
+            waiter = asyncio.create_task(scheduler.slot("key", "/endpoint").__aenter__())
+            await asyncio.sleep(0)
+            waiter.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await waiter
+        self.assertEqual(scheduler.stats, {"requests_in_flight": 0, "queued_requests": 0})
+        async with scheduler.slot("key", "/endpoint"):
+            pass
+
+    async def test_slot_granted_to_cancelled_waiter_is_released(self):
+        scheduler = RequestScheduler(1, rate_limits={"/endpoint": 600})
+        holder = scheduler.slot("key", "/endpoint")
+        await holder.__aenter__()
+        waiter = asyncio.create_task(scheduler.slot("key", "/endpoint").__aenter__())
+        await asyncio.sleep(0)
+        # The slot is granted to the waiter, which is cancelled before it resumes
+        await holder.__aexit__(None, None, None)
+        waiter.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await waiter
+        self.assertEqual(scheduler.stats["requests_in_flight"], 0)
+        async with scheduler.slot("key", "/endpoint"):
+            pass
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+import os
+import tempfile
+import unittest
+
+from DBService.image_cache import ImageCacheService
+from DBService.transcription_cache import TranscriptionCacheService
+
+class SQLiteCacheTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def db_name(self, name: str) -> str:
+        return os.path.join(self.directory.name, name)
+
+    async def test_transcriptions_are_stored_and_counted(self):
+        cache = TranscriptionCacheService(self.db_name("transcriptions.db"))
+        self.addCleanup(cache.close)
+        self.assertIsNone(await cache.get_transcription("file"))
+        await cache.store_transcription("file", "text")
+        self.assertEqual(await cache.get_transcription("file"), "text")
+        self.assertEqual(cache.stats, {"hits": 1, "misses": 1})
+
+    async def test_images_are_keyed_by_normalized_description_and_size(self):
+        cache = ImageCacheService(self.db_name("images.db"))
+        self.addCleanup(cache.close)
+        await cache.store_images("A  red Cat", "256x256", ["first", "second"])
+        self.assertEqual(await cache.get_images("a red cat", "256x256"), ["first", "second"])
+        self.assertEqual(await cache.get_images("a red cat", "512x512"), [])
+
+    async def test_least_recently_used_entries_are_evicted(self):
+        cache = TranscriptionCacheService(self.db_name("transcriptions.db"), max_entries=2)
+        self.addCleanup(cache.close)
+        await cache.store_transcription("first", "1")
+        await cache.store_transcription("second", "2")
+        # Reading the first entry makes the second one the least recently used
+        await cache.get_transcription("first")
+        await cache.store_transcription("third", "3")
+        self.assertEqual(await cache.get_transcription("first"), "1")
+        self.assertIsNone(await cache.get_transcription("second"))
+        self.assertEqual(await cache.get_transcription("third"), "3")
+
+    async def test_entries_survive_reopening(self):
+        cache = ImageCacheService(self.db_name("images.db"))
+        await cache.store_images("cat", "256x256", ["file"])
+        cache.close()
+        cache = ImageCacheService(self.db_name("images.db"))
+        self.addCleanup(cache.close)
+        self.assertEqual(await cache.get_images("cat", "256x256"), ["file"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+import asyncio
+import datetime
+import unittest
+
+from telegram import Chat, Message, Update
+
+from bot_api_calls import BotApiCallsCounter
+from update_processor import ChatOrderedUpdateProcessor
+
+def make_update(update_id: int, chat_id: int) -> Update:
+    chat = Chat(chat_id, Chat.PRIVATE)
+    return Update(update_id, message=Message(update_id, datetime.datetime.now(datetime.timezone.utc), chat))
+
+class ChatOrderedUpdateProcessorTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.received_updates = []
+        self.processor = ChatOrderedUpdateProcessor(4, 3, BotApiCallsCounter(), self.received_updates.append)
+        self.events = []
+
+    async def handle(self, update: Update, duration: float = 0.02):
+        self.events.append(("start", update.effective_chat.id, update.update_id))
+        await asyncio.sleep(duration)
+        self.events.append(("end", update.effective_chat.id, update.update_id))
+
+    async def process(self, update: Update, duration: float = 0.02):
+        await self.processor.process_update(update, self.handle(update, duration))
+
+    async def test_updates_of_chat_are_processed_in_order(self):
+        updates = [make_update(update_id, 1) for update_id in range(3)]
+        # Later updates finish faster, so they would overtake the earlier ones without ordering
+        await asyncio.gather(*(self.process(update, 0.03 - update.update_id * 0.01) for update in updates))
+        self.assertEqual(self.events, [
+            ("start", 1, 0), ("end", 1, 0),
+            ("start", 1, 1), ("end", 1, 1),
+            ("start", 1, 2), ("end", 1, 2)
+        ])
+        self.assertEqual(self.received_updates, updates)
+
+    async def test_different_chats_are_processed_concurrently(self):
+        await asyncio.gather(
+            self.process(make_update(1, 1)), self.process(make_update(2, 1)),
+            self.process(make_update(3, 2)), self.process(make_update(4, 2))
+        )
+        # Both chats start their first update before any update ends
+        self.assertEqual(sorted(self.events[:2]), [("start", 1, 1), ("start", 2, 3)])
+        for chat_id, first_update_id, second_update_id in ((1, 1, 2), (2, 3, 4)):
+            chat_events = [event for event in self.events if event[1] == chat_id]
+            self.assertEqual([event[2] for event in chat_events], [first_update_id, first_update_id, second_update_id, second_update_id])
+
+    async def test_pending_updates_are_tracked_and_cleaned_up(self):
+        tasks = [asyncio.create_task(self.process(make_update(update_id, 1))) for update_id in range(2)]
+        await asyncio.sleep(0.005)
+        self.assertTrue(self.processor.has_pending_updates(1))
+        self.assertFalse(self.processor.has_pending_updates(2))
+        self.assertEqual(self.processor.stats, {"busy_chats": 1, "pending_updates": 2})
+
+        await asyncio.gather(*tasks)
+        self.assertFalse(self.processor.has_pending_updates(1))
+        self.assertEqual(self.processor.stats, {"busy_chats": 0, "pending_updates": 0})
+        self.assertEqual(self.processor._chat_locks, {})
+
+    async def test_updates_over_chat_queue_size_are_dropped(self):
+        with self.assertLogs("update_processor", "WARNING"):
+            await asyncio.gather(*(self.process(make_update(update_id, 1)) for update_id in range(5)))
+        self.assertEqual([event[2] for event in self.events if event[0] == "start"], [0, 1, 2])
+        self.assertEqual(self.processor.stats, {"busy_chats": 0, "pending_updates": 0})
+
+    async def test_failed_update_releases_chat(self):
+        async def fail():
+            raise RuntimeError("handler failed")
+
+        with self.assertRaises(RuntimeError):
+            await self.processor.process_update(make_update(1, 1), fail())
+        self.assertEqual(self.processor.stats, {"busy_chats": 0, "pending_updates": 0})
+        await self.process(make_update(2, 1))
+        self.assertEqual(self.events[-1], ("end", 1, 2))
+
+    async def test_updates_without_chat_are_processed(self):
+        await self.processor.process_update(Update(1), asyncio.sleep(0))
+        self.assertEqual(self.processor.stats, {"busy_chats": 0, "pending_updates": 0})
+
+if __name__ == "__main__":
+    unittest.main()
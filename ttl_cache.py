@@ -0,0 +1,59 @@
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+
+class TTLCache:
+    # Bounded mapping which evicts the least recently used entry when full and expires entries after ttl seconds.
+    # With weigher the total weight of values (e.g. their size in memory) is limited by max_weight as well.
+    def __init__(self, max_size: int, ttl: float, weigher: Callable[[Any], int] | None = None, max_weight: int | None = None):
+        self._max_size = max_size
+        self._ttl = ttl
+        self._weigher = weigher
+        self._max_weight = max_weight
+        self._weight = 0
+        self._entries = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+
+    @property
+    def hits(self) -> int:
+        return self._hits
+
+    @property
+    def misses(self) -> int:
+        return self._misses
+
+    @property
+    def weight(self) -> int:
+        return self._weight
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._entries.get(key)
+        if entry is None or entry[1] < time.monotonic():
+            if entry is not None:
+                self.pop(key)
+            self._misses += 1
+            return default
+        self._entries.move_to_end(key)
+        self._hits += 1
+        return entry[0]
+
+    def set(self, key: Hashable, value: Any):
+        self.pop(key)
+        self._entries[key] = (value, time.monotonic() + self._ttl)
+        self._weight += self._weigh(value)
+        while len(self._entries) > self._max_size or (self._max_weight is not None and self._weight > self._max_weight):
+            self.pop(next(iter(self._entries)))
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return default
+        self._weight -= self._weigh(entry[0])
+        return entry[0]
+
+    def _weigh(self, value: Any) -> int:
+        return self._weigher(value) if self._weigher else 0
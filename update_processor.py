@@ -0,0 +1,76 @@
+import asyncio
+import logging
+logger = logging.getLogger(__name__)
+
+from typing import Any, Awaitable, Callable
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+from bot_api_calls import BotApiCallsCounter
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    # Processes updates of different chats concurrently, but updates of the same chat strictly one by one
+    # in the order they were received, so handlers never race on the chat state stored in chat_data.
+    def __init__(
+        self,
+        max_concurrent_updates: int,
+        max_chat_queue_size: int,
+        bot_api_calls_counter: BotApiCallsCounter,
+        on_update_received: Callable[[object], None] | None = None
+    ):
+        # Updates waiting for their chat must not occupy a processing slot, so the base semaphore only
+        # limits the number of accepted updates and the concurrency cap is applied by _workers_semaphore.
+        super().__init__(max_concurrent_updates * max_chat_queue_size)
+        self._workers_semaphore = asyncio.Semaphore(max_concurrent_updates)
+        self._max_chat_queue_size = max_chat_queue_size
+        self._chat_locks: dict[int, asyncio.Lock] = {}
+        self._chat_queue_sizes: dict[int, int] = {}
+        self._bot_api_calls_counter = bot_api_calls_counter
+        self._on_update_received = on_update_received
+
+    @property
+    def stats(self) -> dict:
+        return {
+            "busy_chats": len(self._chat_queue_sizes),
+            "pending_updates": sum(self._chat_queue_sizes.values())
+        }
+
+    def has_pending_updates(self, chat_id: int) -> bool:
+        return chat_id in self._chat_queue_sizes
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]):
+        # Called before the update waits for its chat, so it can e.g. abort an operation the chat is busy with
+        if self._on_update_received:
+            self._on_update_received(update)
+
+        chat_id = update.effective_chat.id if isinstance(update, Update) and update.effective_chat else None
+        if chat_id is None:
+            async with self._workers_semaphore:
+                await self._process(update, coroutine)
+            return
+
+        queue_size = self._chat_queue_sizes.get(chat_id, 0)
+        if queue_size >= self._max_chat_queue_size:
+            logger.warning(f"Update {update.update_id} dropped: chat {chat_id} already has {queue_size} pending updates")
+            coroutine.close()
+            return
+
+        self._chat_queue_sizes[chat_id] = queue_size + 1
+        chat_lock = self._chat_locks.setdefault(chat_id, asyncio.Lock())
+        try:
+            async with chat_lock, self._workers_semaphore:
+                await self._process(update, coroutine)
+        finally:
+            self._chat_queue_sizes[chat_id] -= 1
+            if self._chat_queue_sizes[chat_id] == 0:
+                del self._chat_queue_sizes[chat_id]
+                del self._chat_locks[chat_id]
+
+    async def _process(self, update: object, coroutine: Awaitable[Any]):
+        with self._bot_api_calls_counter.interaction(update.update_id if isinstance(update, Update) else None):
+            await coroutine
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
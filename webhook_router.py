@@ -0,0 +1,92 @@
+import asyncio
+import json
+import logging
+import multiprocessing
+import signal
+logger = logging.getLogger(__name__)
+
+from typing import Callable
+
+import httpx
+from telegram import Bot, Update
+
+import constants
+from webhook_server import WebhookServer
+
+class WebhookRouter:
+    # Receives Telegram webhook requests and forwards every update to one of the worker processes.
+    # The worker is chosen by chat id, so ChatState and session of a chat always live in the same worker,
+    # while data shared by all chats (API keys, persisted sessions, caches) is kept in SQLite databases.
+    def __init__(
+        self,
+        token: str,
+        webhook_url: str,
+        host: str,
+        port: int,
+        secret_token: str,
+        workers_count: int,
+        workers_base_port: int,
+        metrics_base_port: int | None,
+        run_worker: Callable[[str, str, int, str, int | None], None]
+    ):
+        self._token = token
+        self._webhook_url = webhook_url
+        self._host = host
+        self._port = port
+        self._secret_token = secret_token
+        self._workers_count = workers_count
+        self._workers_base_port = workers_base_port
+        self._metrics_base_port = metrics_base_port
+        self._run_worker = run_worker
+        self._client = None
+
+    def run(self):
+        context = multiprocessing.get_context("spawn")
+        workers = [
+            context.Process(target=self._run_worker, args=(
+                self._token,
+                constants.WEBHOOK_WORKERS_HOST,
+                self._workers_base_port + index,
+                self._secret_token,
+                # Every worker exposes its own metrics on the next port
+                self._metrics_base_port + index if self._metrics_base_port else None
+            ))
+            for index in range(self._workers_count)
+        ]
+        for worker in workers:
+            worker.start()
+        logger.info(f"Started {self._workers_count} bot workers")
+        try:
+            asyncio.run(self._serve())
+        finally:
+            for worker in workers:
+                worker.terminate()
+            for worker in workers:
+                worker.join()
+
+    async def _serve(self):
+        stop_event = asyncio.Event()
+        for stop_signal in (signal.SIGINT, signal.SIGTERM):
+            asyncio.get_running_loop().add_signal_handler(stop_signal, stop_event.set)
+
+        async with httpx.AsyncClient(timeout=constants.WEBHOOK_FORWARD_TIMEOUT_SECONDS) as client, Bot(self._token) as bot:
+            self._client = client
+            server = WebhookServer(self._host, self._port, self._secret_token, self._route_update)
+            await server.start()
+            await bot.set_webhook(self._webhook_url, secret_token=self._secret_token)
+            await stop_event.wait()
+            await server.stop()
+
+    async def _route_update(self, body: bytes):
+        worker_port = self._workers_base_port + self._get_worker_index(json.loads(body))
+        headers = {constants.WEBHOOK_SECRET_TOKEN_HEADER: self._secret_token}
+        response = await self._client.post(f"http://{constants.WEBHOOK_WORKERS_HOST}:{worker_port}/", content=body, headers=headers)
+        response.raise_for_status()
+
+    def _get_worker_index(self, update_data: dict) -> int:
+        update = Update.de_json(update_data, None)
+        if update.effective_chat:
+            return update.effective_chat.id % self._workers_count
+        if update.effective_user:
+            return update.effective_user.id % self._workers_count
+        return 0
@@ -0,0 +1,68 @@
+import asyncio
+import hmac
+import logging
+logger = logging.getLogger(__name__)
+
+from typing import Awaitable, Callable
+
+import constants
+from http_request import HttpRequestError, read_http_request
+
+class WebhookServer:
+    # Minimal HTTP/1.1 server which accepts Telegram webhook requests and passes their bodies to handle_update.
+    # TLS is expected to be terminated by a reverse proxy in front of it. Every request must carry the secret token,
+    # otherwise anyone who can reach the port could send updates on behalf of any user. Slow or idle clients are
+    # disconnected by timeouts, so they can't hold connections forever.
+    def __init__(self, host: str, port: int, secret_token: str, handle_update: Callable[[bytes], Awaitable]):
+        if not secret_token:
+            raise ValueError("Webhook server requires a secret token")
+        self._host = host
+        self._port = port
+        self._secret_token = secret_token
+        self._handle_update = handle_update
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_connection, self._host, self._port)
+        logger.info(f"Webhook server is listening on {self._host}:{self._port}")
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                try:
+                    request = await read_http_request(reader, constants.WEBHOOK_MAX_BODY_SIZE)
+                except HttpRequestError as error:
+                    await self._respond(writer, error.status)
+                    break
+                if not request:
+                    break
+
+                if request.method != b"POST":
+                    await self._respond(writer, "405 Method Not Allowed")
+                elif not hmac.compare_digest(request.headers.get(constants.WEBHOOK_SECRET_TOKEN_HEADER, ""), self._secret_token):
+                    await self._respond(writer, "403 Forbidden")
+                else:
+                    try:
+                        await self._handle_update(request.body)
+                    except Exception as error:
+                        # Telegram delivers the update again if it was not accepted
+                        logger.error(f"Webhook update was not handled: {error}")
+                        await self._respond(writer, "500 Internal Server Error")
+                    else:
+                        await self._respond(writer, "200 OK")
+
+                if not request.keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _respond(writer: asyncio.StreamWriter, status: str):
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Length: 0\r\n\r\n".encode())
+        await writer.drain()